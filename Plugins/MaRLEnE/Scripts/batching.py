@@ -0,0 +1,32 @@
+"""
+ -------------------------------------------------------------------------
+ MaRLEnE - batching.py
+
+ Batching of the replies of several environments (server instances
+ behind the gateway or playing worlds of one server) into one reply.
+
+ created: 2026/10/19
+ -------------------------------------------------------------------------
+"""
+
+import numpy as np
+
+
+def stack(values):
+    """
+    Stacks the values of the same reply field from several environments along a new first axis: dicts key by key,
+    numbers and equally shaped arrays into one numpy array, everything else into a list.
+    """
+    if all(isinstance(v, dict) for v in values):
+        keys = set(values[0])
+        if all(set(v) == keys for v in values):
+            return {k: stack([v[k] for v in values]) for k in keys}
+        return values
+    if all(isinstance(v, (bool, int, float, np.ndarray, np.number, np.bool_)) for v in values):
+        shapes = set(np.shape(v) for v in values)
+        if len(shapes) == 1:
+            return np.stack([np.asarray(v) for v in values])
+    elif all(isinstance(v, (list, tuple)) and all(isinstance(x, (int, float)) for x in v) for v in values):
+        if len(set(len(v) for v in values)) == 1:
+            return np.array(values)
+    return values
@@ -0,0 +1,181 @@
+"""
+ -------------------------------------------------------------------------
+ MaRLEnE - framing.py
+
+ Message framing of the MaRLEnE protocol: An 8-byte ASCII length header
+ followed by the msgpack'd message.
+ With out-of-band framing, numpy arrays are not packed into the message:
+ The message only carries a small table (`_oob`) describing the arrays
+ (key, dtype, shape, offset, num bytes) and the raw array buffers follow
+ the message as they are (no copies on either side).
+ Does not depend on unreal_engine, such that clients can use it as well.
+
+ created: 2026/10/19
+ -------------------------------------------------------------------------
+"""
+
+import msgpack
+import msgpack_numpy as mnp
+import numpy as np
+
+# make msgpack use the numpy-specific de/encoders (for the arrays that stay in-band)
+mnp.patch()
+
+HEADER_LEN = 8
+# the dtype kinds that can be sent as raw buffers (bool, int, uint, float, complex)
+OOB_KINDS = "biufc"
+
+
+def pack(message):
+    """
+    Returns: The framed message (header + msgpack'd message) as bytes.
+    """
+    message = msgpack.packb(message)
+    return bytes("{:08d}".format(len(message)), encoding="ascii") + message
+
+
+def pack_out_of_band(message, copy_keys=()):
+    """
+    Frames a message, sending all numeric numpy arrays out-of-band: Each array is replaced in the message by a
+    placeholder ({"__oob__": [index]}) and described in the message's `_oob` table as [key, dtype, shape, offset,
+    num bytes] (offset relative to the end of the message). The array buffers themselves are returned as memoryviews
+    to be written right after the message (e.g. via StreamWriter.writelines).
+    Arrays are searched for in dicts and lists (the keys of arrays inside lists are prefixed with their list indices,
+    e.g. "1/CamObs/camera" for the camera in the obs_dict of agent 1). An array that occurs several times in the
+    message (e.g. a camera image shared by all agents) is only sent once.
+    The arrays must not be changed until they have been written.
+    Unlike `pack`, strings and bytes are packed as different types (use_bin_type), so the receiver can unpack with
+    raw=False.
+
+    Args:
+        message (dict): The message to send.
+        copy_keys (tuple): Top-level keys of the message whose arrays have to be copied first (e.g. arrays that are
+            reused in place and thus could change before they are written).
+
+    Returns: The list of chunks to write (header, msgpack'd message, array buffers).
+    """
+    table = []
+    buffers = []
+    indices = {}  # id of an already sent array -> its index in the table
+
+    def replace(key, value, prefix=""):
+        if isinstance(value, np.ndarray):
+            if value.dtype.kind not in OOB_KINDS or value.size == 0:
+                return value
+            if id(value) in indices:
+                return {"__oob__": indices[id(value)]}
+            original = value
+            # only copies non-contiguous arrays (e.g. images with the alpha channel sliced away)
+            value = np.array(value, order="C") if key in copy_keys else np.ascontiguousarray(value)
+            offset = table[-1][3] + table[-1][4] if table else 0
+            table.append([prefix + key, value.dtype.str, list(value.shape), offset, value.nbytes])
+            buffers.append(memoryview(value).cast("B"))
+            indices[id(original)] = len(table) - 1
+            return {"__oob__": len(table) - 1}
+        elif isinstance(value, dict):
+            replaced = {k: replace(k, v, prefix) for k, v in value.items()}
+            return replaced if any(replaced[k] is not v for k, v in value.items()) else value
+        elif isinstance(value, (list, tuple)):
+            replaced = [replace(key, v, "{}{}/".format(prefix, i)) for i, v in enumerate(value)]
+            return replaced if any(r is not v for r, v in zip(replaced, value)) else value
+        return value
+
+    envelope = {k: replace(k, v) for k, v in message.items()}
+    if table:
+        envelope["_oob"] = table
+    envelope = msgpack.packb(envelope, use_bin_type=True)
+    return [bytes("{:08d}".format(len(envelope)), encoding="ascii"), envelope] + buffers
+
+
+def resolve_out_of_band(message, arrays):
+    """
+    Puts the received out-of-band arrays back into the message (in place of their placeholders).
+
+    Args:
+        message (dict): The unpacked message (still containing the `_oob` table).
+        arrays (list): The received arrays (in the order of the `_oob` table).
+
+    Returns: The message with all placeholders replaced (and without the `_oob` table).
+    """
+    def resolve(value):
+        if isinstance(value, dict):
+            if len(value) == 1 and "__oob__" in value:
+                return arrays[value["__oob__"]]
+            return {k: resolve(v) for k, v in value.items()}
+        elif isinstance(value, (list, tuple)):
+            return [resolve(v) for v in value]
+        return value
+
+    message.pop("_oob", None)
+    return resolve(message)
+
+
+def get_oob_array(spec, preallocated=None):
+    """
+    Returns the array to receive an out-of-band buffer into: The preallocated one for the spec's key (if it has the
+    right dtype and shape), a new one otherwise (which is then stored in `preallocated` for the next message).
+    """
+    key, dtype, shape, _, _ = spec
+    shape = tuple(shape)
+    array = preallocated.get(key) if preallocated is not None else None
+    if array is None or array.dtype.str != dtype or array.shape != shape:
+        array = np.empty(shape, dtype=np.dtype(dtype))
+        if preallocated is not None:
+            preallocated[key] = array
+    return array
+
+
+def recv_message(sock, preallocated=None):
+    """
+    Receives one message from a (blocking) socket, reading all out-of-band buffers directly into their arrays.
+
+    Args:
+        sock (socket.socket): The connected socket.
+        preallocated (Union[dict,None]): Arrays (by key) to receive out-of-band buffers into. New arrays are added to
+            it, such that passing the same dict with each call receives e.g. the camera images always into the same
+            memory. Note that the returned message then references these arrays (they are overwritten by the next
+            call).
+
+    Returns: The unpacked message.
+    """
+    def recv_into(view):
+        while len(view):
+            received = sock.recv_into(view)
+            if not received:
+                raise ConnectionError("Socket closed while receiving a message!")
+            view = view[received:]
+
+    header = bytearray(HEADER_LEN)
+    recv_into(memoryview(header))
+    envelope = bytearray(int(header))
+    recv_into(memoryview(envelope))
+    message = msgpack.unpackb(envelope, raw=False)
+    if not isinstance(message, dict) or "_oob" not in message:
+        return message
+    arrays = []
+    for spec in message["_oob"]:
+        array = get_oob_array(spec, preallocated)
+        recv_into(memoryview(array).cast("B"))
+        arrays.append(array)
+    return resolve_out_of_band(message, arrays)
+
+
+async def read_message(reader):
+    """
+    Reads one message from an asyncio StreamReader (out-of-band buffers become read-only arrays on top of the
+    received bytes, no further copies).
+
+    Args:
+        reader (asyncio.StreamReader): The reader of the connection.
+
+    Returns: The unpacked message.
+    """
+    header = await reader.readexactly(HEADER_LEN)
+    message = msgpack.unpackb(await reader.readexactly(int(header)), raw=False)
+    if not isinstance(message, dict) or "_oob" not in message:
+        return message
+    arrays = []
+    for key, dtype, shape, _, num_bytes in message["_oob"]:
+        data = await reader.readexactly(num_bytes)
+        arrays.append(np.frombuffer(data, dtype=np.dtype(dtype)).reshape(shape))
+    return resolve_out_of_band(message, arrays)
@@ -0,0 +1,166 @@
+"""
+ -------------------------------------------------------------------------
+ MaRLEnE - free_running.py
+
+ Free-running (real-time) mode: The game ticks at its native rate, the
+ observations are sampled at a fixed rate and pushed to the controlling
+ client, and the most recent action sent by the client is applied at the
+ next engine tick.
+
+ created: 2026/10/19
+ -------------------------------------------------------------------------
+"""
+
+import unreal_engine as ue
+from unreal_engine.classes import GameplayStatics
+import server_utils as util
+import time
+
+
+class FreeRunner(object):
+    """
+    Drives the game in free-running mode through an engine ticker (called once per engine tick).
+    """
+    def __init__(self, compile_and_publish, send):
+        """
+        Args:
+            compile_and_publish (callable): Function taking (session, key_filter, packed) and returning the reply for
+                the session (see marlene_server.compile_and_publish).
+            send (callable): Function taking (message, session, droppable) to send a message to the client.
+        """
+        self.compile_and_publish = compile_and_publish
+        self.send = send
+        self.session = None
+        self.running = False
+        self.sample_interval = 0.0
+        self.key_filter = None
+        self.packed = False
+        self._time_since_sample = 0.0
+        self._last_sample = None
+        self._pending = None  # the most recent, not yet applied action message
+        self._pressed = None  # the actions pressed at the last tick (need to be released at the next one)
+        self._ticker_id = 0  # only the ticker added by the latest `start` keeps ticking
+        self.world_id = 0  # the playing world that is free-running (see server_utils.select_world)
+        self.restarting = False  # whether a `reset` waits for the level to be restarted (no ticking until then)
+        self.num_ticks = 0
+        self.num_samples = 0
+        self.num_actions = 0
+        self.num_dropped_actions = 0
+
+    def start(self, session, rate, key_filter=None, packed=False):
+        """
+        Unpauses the game (the selected playing world; see server_utils.select_world) and starts sampling
+        observations for the given (controlling) session.
+
+        Args:
+            session (Session): The session to push the observations to.
+            rate (float): The number of observation samples per second.
+            key_filter (Union[KeyFilter,None]): The filter deciding which observation keys to evaluate.
+            packed (bool): Whether to compile the non-image observations into the packed arrays.
+
+        Returns: An error message if the game could not be started, None otherwise.
+        """
+        playing_world = util.get_playing_world()
+        if not playing_world:
+            return "No playing world!"
+
+        self.session = session
+        self.world_id = util.get_world_id()
+        self.sample_interval = 1.0 / rate
+        self.key_filter = key_filter
+        self.packed = packed
+        self._time_since_sample = 0.0
+        self._last_sample = None
+        self._pending = self._pressed = None
+        self.num_ticks = self.num_samples = self.num_actions = self.num_dropped_actions = 0
+
+        GameplayStatics.SetGamePaused(playing_world, False)
+        self.running = True
+        self._ticker_id += 1
+        ticker_id = self._ticker_id
+        ue.add_ticker(lambda delta_time: self._tick(delta_time, ticker_id))
+        ue.log("Free-running mode started (sample rate={}/s).".format(rate))
+        return None
+
+    def stop(self):
+        """
+        Stops sampling and pauses the game again (back to lock-step mode).
+        """
+        if not self.running:
+            return
+        # our ticker will remove itself at the next tick
+        self.running = False
+        self.session = None
+        previous = util.select_world(self.world_id)
+        try:
+            playing_world = util.get_playing_world()
+            if playing_world:
+                if self._pressed:
+                    util.release_actions(util.get_player_controller(playing_world), self._pressed)
+                GameplayStatics.SetGamePaused(playing_world, True)
+        finally:
+            util.select_world(previous)
+        self._pending = self._pressed = None
+        ue.log("Free-running mode stopped.")
+
+    def act(self, message):
+        """
+        Stores an action (fields `axes` and `actions` like in the `step` command) to be applied at the next tick.
+        An action that was not applied yet is replaced (and counted as dropped).
+        """
+        if self._pending is not None:
+            self.num_dropped_actions += 1
+        self._pending = message
+
+    def get_stats(self):
+        return {"running": self.running, "num_ticks": self.num_ticks, "num_samples": self.num_samples,
+                "num_actions": self.num_actions, "num_dropped_actions": self.num_dropped_actions}
+
+    def _tick(self, delta_time, ticker_id):
+        # returning False removes the ticker
+        if not self.running or ticker_id != self._ticker_id:
+            return False
+        if self.restarting:
+            return True
+        # the ticker may run while a command works on another world (e.g. a `reset` waiting for the next tick)
+        previous = util.select_world(self.world_id)
+        try:
+            return self._tick_world(delta_time)
+        finally:
+            util.select_world(previous)
+
+    def _tick_world(self, delta_time):
+        playing_world = util.get_playing_world()
+        if not playing_world:
+            return True
+        self.num_ticks += 1
+
+        # release the actions pressed at the previous tick, then apply the most recent action
+        controller = util.get_player_controller(playing_world)
+        if self._pressed:
+            util.release_actions(controller, self._pressed)
+            self._pressed = None
+        if self._pending is not None:
+            message, self._pending = self._pending, None
+            util.apply_inputs(controller, message.get("axes"), message.get("actions"), delta_time)
+            self._pressed = message.get("actions")
+            self.num_actions += 1
+
+        # sample the observations at our fixed rate
+        self._time_since_sample += delta_time
+        if self._time_since_sample >= self.sample_interval:
+            self._time_since_sample %= self.sample_interval
+            self._sample()
+        return True
+
+    def _sample(self):
+        now = time.time()
+        reply = self.compile_and_publish(self.session, self.key_filter, self.packed)
+        self.num_samples += 1
+        reply["push"] = "obs"
+        reply["sample"] = self.num_samples
+        reply["timestamp"] = now
+        reply["dt"] = now - self._last_sample if self._last_sample is not None else 0.0
+        reply["num_dropped_actions"] = self.num_dropped_actions
+        self._last_sample = now
+        self.send(reply, self.session, True)
@@ -13,8 +13,8 @@
  -------------------------------------------------------------------------
 """
 
-import asyncio
+import server_state
 
-# cleanup previous tasks
-for task in asyncio.Task.all_tasks():
-    task.cancel()
+# cold shutdown: close the listening server and cancel all tasks (a following import of marlene_server starts
+# from scratch)
+server_state.shutdown()
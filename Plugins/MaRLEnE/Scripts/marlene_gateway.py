@@ -0,0 +1,292 @@
+"""
+ -------------------------------------------------------------------------
+ MaRLEnE - marlene_gateway.py
+
+ Standalone gateway (runs outside of UE4) that keeps persistent
+ connections to a pool of marlene_server instances and exposes them all
+ behind one port (same protocol as the server itself):
+ - Commands with an `instance` field are forwarded to that instance.
+ - `reset`, `seed` and `step` without an `instance` field are sent to all
+   available instances in parallel and answered with one batched reply
+   (all fields stacked along a new first axis, in the order of the reply's
+   `instances` list). Per-instance fields (e.g. the actions for `step` or
+   the seed values) go into `per_instance` (instance id -> fields).
+ - `instances` lists the pool and the state of each instance.
+ Instances that fail (connection lost or timed out) are marked unavailable
+ and left out of all batches until they could be reconnected.
+
+ usage: python marlene_gateway.py --port 6000 localhost:6025-6032 other-node:6025
+
+ created: 2026/10/19
+ -------------------------------------------------------------------------
+"""
+
+import argparse
+import asyncio
+import logging
+import framing
+from batching import stack
+
+
+# commands that are sent to all instances if they have no `instance` field
+BROADCAST_COMMANDS = ("reset", "seed", "step")
+
+logger = logging.getLogger("marlene_gateway")
+
+
+class Instance(object):
+    """
+    The persistent connection to one game server.
+    Requests are sent one at a time (the server answers in order), observation pushes are skipped.
+    """
+    def __init__(self, id_, host, port, timeout=30.0, retry_interval=2.0):
+        """
+        Args:
+            id_ (str): The id under which clients address this instance.
+            host (str): The host of the game server.
+            port (int): The port of the game server.
+            timeout (float): The max. number of seconds to wait for a reply before marking the instance unavailable.
+            retry_interval (float): The number of seconds between two reconnection attempts.
+        """
+        self.id = id_
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.reader = None
+        self.writer = None
+        self.available = False
+        self.last_error = None
+        self.num_requests = 0
+        self.num_failures = 0
+        self._lock = asyncio.Lock()
+        self._lost = asyncio.Event()
+        self._lost.set()
+        self.task = asyncio.ensure_future(self._keep_connected())
+
+    def get_stats(self):
+        return {"address": "{}:{}".format(self.host, self.port), "available": self.available,
+                "last_error": self.last_error, "num_requests": self.num_requests, "num_failures": self.num_failures}
+
+    async def request(self, message):
+        """
+        Sends a message and waits for the reply.
+
+        Returns: The reply dict (an error reply if the instance is unavailable or failed while waiting).
+        """
+        if not self.available:
+            return {"status": "error", "message": "Instance {} is unavailable ({})!".format(self.id, self.last_error),
+                    "unavailable": True}
+        async with self._lock:
+            try:
+                self.num_requests += 1
+                return await asyncio.wait_for(self._request(message), self.timeout)
+            except (ConnectionError, OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                # we don't know where in the stream we are anymore -> reconnect
+                self._fail("{}: {}".format(type(e).__name__, e))
+                return {"status": "error", "message": "Instance {} failed ({})!".format(self.id, self.last_error),
+                        "unavailable": True}
+
+    def close(self):
+        self.task.cancel()
+        if self.writer is not None:
+            self.writer.close()
+
+    async def _request(self, message):
+        self.writer.write(framing.pack(message))
+        await self.writer.drain()
+        while True:
+            reply = await framing.read_message(self.reader)
+            if not isinstance(reply, dict) or "push" not in reply:
+                return reply
+
+    def _fail(self, error):
+        logger.warning("Instance %s (%s:%s) unavailable: %s", self.id, self.host, self.port, error)
+        self.available = False
+        self.last_error = error
+        self.num_failures += 1
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+        self._lost.set()
+
+    async def _keep_connected(self):
+        while True:
+            await self._lost.wait()
+            try:
+                self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port),
+                                                                  self.timeout)
+                # have all arrays sent as raw buffers (see framing.pack_out_of_band)
+                reply = await asyncio.wait_for(self._request({"cmd": "session", "options": {"out_of_band": True}}),
+                                               self.timeout)
+                if reply.get("status") != "ok":
+                    raise ConnectionError(reply.get("message"))
+            except (ConnectionError, OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                self.last_error = "{}: {}".format(type(e).__name__, e)
+                if self.writer is not None:
+                    self.writer.close()
+                self.reader = self.writer = None
+                await asyncio.sleep(self.retry_interval)
+                continue
+            logger.info("Instance %s connected (%s:%s).", self.id, self.host, self.port)
+            self.available = True
+            self.last_error = None
+            self._lost.clear()
+
+
+class Gateway(object):
+    """
+    Serves the clients of the gateway and dispatches their commands to the instances.
+    """
+    def __init__(self, instances):
+        """
+        Args:
+            instances (list): The Instance objects of the pool.
+        """
+        self.instances = {instance.id: instance for instance in instances}
+        self.num_clients = 0
+
+    async def handle_client(self, reader, writer):
+        self.num_clients += 1
+        peername = writer.get_extra_info("peername")
+        logger.info("New client connection from %s.", peername)
+        options = {}
+        try:
+            while True:
+                try:
+                    message = await framing.read_message(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                if not isinstance(message, dict):
+                    reply = {"status": "error",
+                             "message": "Unknown message type ({})!".format(type(message).__name__)}
+                elif message.get("cmd") == "session" and "instance" not in message:
+                    options.update(message.get("options", {}))
+                    reply = {"status": "ok", "options": options}
+                else:
+                    reply = await self.dispatch(message)
+                if options.get("out_of_band"):
+                    writer.writelines(framing.pack_out_of_band(reply))
+                else:
+                    writer.write(framing.pack(reply))
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            logger.warning("Client %s failed: %s", peername, e)
+        finally:
+            self.num_clients -= 1
+            writer.close()
+            logger.info("Client %s disconnected.", peername)
+
+    async def dispatch(self, message):
+        """
+        Returns: The reply to a gateway client's message.
+        """
+        cmd = message.get("cmd")
+        if "instance" in message:
+            id_ = str(message.pop("instance"))
+            if id_ not in self.instances:
+                return {"status": "error", "message": "Unknown instance ({})!".format(id_)}
+            reply = await self.instances[id_].request(message)
+            reply["instance"] = id_
+            return reply
+        elif cmd in BROADCAST_COMMANDS:
+            return await self.broadcast(message)
+        elif cmd == "instances":
+            return {"status": "ok", "instances": {id_: i.get_stats() for id_, i in self.instances.items()}}
+        return {"status": "error", "message": "Command '{}' needs an 'instance' field (only {} can be broadcast)!".
+                format(cmd, BROADCAST_COMMANDS)}
+
+    async def broadcast(self, message):
+        """
+        Sends a command to all available instances in parallel and batches their replies.
+        Instances that are unavailable (or fail while waiting) are listed in `unavailable`, instances that reply
+        with an error in `errors` (id -> error message); both are left out of the batch.
+        """
+        per_instance = message.pop("per_instance", None) or {}
+        if not isinstance(per_instance, dict):
+            return {"status": "error", "message": "Field 'per_instance' is not a dict (instance id -> fields)!"}
+        unknown = set(str(id_) for id_ in per_instance) - set(self.instances)
+        if unknown:
+            return {"status": "error", "message": "Unknown instance(s) in 'per_instance' ({})!".format(sorted(unknown))}
+        per_instance = {str(id_): fields for id_, fields in per_instance.items()}
+
+        ids = [id_ for id_, instance in self.instances.items() if instance.available]
+        requests = []
+        for id_ in ids:
+            request = dict(message)
+            request.update(per_instance.get(id_, {}))
+            requests.append(self.instances[id_].request(request))
+        replies = await asyncio.gather(*requests)
+
+        ok_ids, ok_replies, errors = [], [], {}
+        unavailable = [id_ for id_, instance in self.instances.items() if id_ not in ids]
+        for id_, reply in zip(ids, replies):
+            if reply.get("status") == "ok":
+                ok_ids.append(id_)
+                ok_replies.append(reply)
+            elif reply.get("unavailable"):
+                unavailable.append(id_)
+            else:
+                errors[id_] = reply.get("message")
+
+        batch = {"status": "ok" if ok_ids else "error", "instances": ok_ids, "unavailable": unavailable,
+                 "errors": errors}
+        if not ok_ids:
+            batch["message"] = "No instance executed '{}'!".format(message.get("cmd"))
+        else:
+            fields = set(ok_replies[0]) - {"status"}
+            for field in fields:
+                if all(field in reply for reply in ok_replies):
+                    batch[field] = stack([reply[field] for reply in ok_replies])
+        return batch
+
+
+def parse_servers(specs, timeout, retry_interval):
+    """
+    Turns server specifiers into Instance objects: `host:port` or `host:first_port-last_port` (one instance per port),
+    optionally prefixed with `id=` (otherwise the instances are numbered 0, 1, 2, ...).
+    """
+    instances = []
+    for spec in specs:
+        id_, _, address = spec.rpartition("=")
+        host, _, ports = address.rpartition(":")
+        first, _, last = ports.partition("-")
+        ports = range(int(first), int(last or first) + 1)
+        if id_ and len(ports) > 1:
+            raise ValueError("Server specifier {} has an id but more than one port!".format(spec))
+        for port in ports:
+            instances.append(Instance(id_ or str(len(instances)), host or "localhost", port, timeout, retry_interval))
+    if len(set(i.id for i in instances)) != len(instances):
+        raise ValueError("Instance ids are not unique!")
+    return instances
+
+
+async def spawn_gateway(host, port, gateway):
+    server = await asyncio.start_server(gateway.handle_client, host, port)
+    logger.info("Gateway listening on %s:%s (%d instances).", host, port, len(gateway.instances))
+    await server.wait_closed()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MaRLEnE gateway: Fronts many game servers behind one port.")
+    parser.add_argument("servers", nargs="+", help="[id=]host:port or [id=]host:first_port-last_port")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=6000)
+    parser.add_argument("--timeout", type=float, default=30.0, help="max. seconds to wait for an instance's reply")
+    parser.add_argument("--retry-interval", type=float, default=2.0, help="seconds between reconnection attempts")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    loop = asyncio.get_event_loop()
+    gateway = Gateway(parse_servers(args.servers, args.timeout, args.retry_interval))
+    try:
+        loop.run_until_complete(spawn_gateway(args.host, args.port, gateway))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for instance in gateway.instances.values():
+            instance.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -13,19 +13,30 @@
  -------------------------------------------------------------------------
 """
 
+import time
+_load_start = time.perf_counter()
+
 import unreal_engine as ue
 import asyncio
 import ue_asyncio
+import server_state
 import server_utils as util
+import framing
+import tracing
+import memory
+from batching import stack
+from sessions import SessionManager, CommandScheduler
+from subscriptions import Subscription
+from free_running import FreeRunner
+from obs_stats import ObsStats
 from unreal_engine.classes import MaRLEnESettings, GameplayStatics, InputSettings
-from unreal_engine.structs import Key
-from unreal_engine.enums import EInputEvent
 import os
 import cProfile, pstats, io
-import time
+import importlib
 
 import msgpack
 import msgpack_numpy as mnp
+import numpy as np
 
 import re
 #import pydevd
@@ -35,14 +46,31 @@ import sys
 # make msgpack use the numpy-specific de/encoders
 mnp.patch()
 
-sys.path.append("c:/program files/pycharm 2017.2.2/debug-eggs/")  # always need to add this to the sys.path (location of PyCharm debug eggs)
-
-ue.add_ticker(util.print_delta_time, 0)
-
-
-# cleanup previous tasks
-for task in asyncio.Task.all_tasks():
-    task.cancel()
+if "c:/program files/pycharm 2017.2.2/debug-eggs/" not in sys.path:
+    sys.path.append("c:/program files/pycharm 2017.2.2/debug-eggs/")  # always need to add this to the sys.path (location of PyCharm debug eggs)
+
+
+# all commands that change the playing world (only allowed for the controlling session)
+CONTROL_COMMANDS = ("step", "reset", "set", "seed", "run", "act", "reload")
+# fields of the `get_stats` command that are only allowed for the controlling session
+CONTROL_STATS_FIELDS = ("reset", "load", "save", "collect")
+# fields of the `memory` command that are only allowed for the controlling session
+CONTROL_MEMORY_FIELDS = ("tracemalloc", "watchdog")
+# fields of the `get_trace` command that are only allowed for the controlling session
+CONTROL_TRACE_FIELDS = ("path", "clear")
+# all commands that need the playing world and thus have to go through the scheduler
+SCHEDULED_COMMANDS = ("step", "reset", "set", "seed", "run", "get", "get_spec", "reload")
+
+# the helper modules that get reloaded along with this one (see reload_server; `memory` is not reloaded to keep its
+# counters and watchdog). Objects carried over keep their classes: changes to Session, OutputQueue and Subscription
+# only apply to connections and subscriptions opened after the reload, changes to SessionManager, CommandScheduler
+# and FreeRunner only after a restart.
+RELOAD_MODULES = ("server_utils", "framing", "batching", "output_queue", "sessions", "subscriptions", "free_running",
+                  "obs_stats", "tracing")
+# commands that can be run in several playing worlds at once (see run_batched)
+BATCHED_COMMANDS = ("step", "reset")
+# reply fields holding arrays that are reused in place for every frame (see server_utils.compile_obs_dict)
+VOLATILE_FIELDS = ("obs_floats", "obs_bools")
 
 
 def seed(message):
@@ -61,9 +89,10 @@ def seed(message):
     return {"status": "ok", "new_seed": value}
 
 
-def reset(writer):
+async def reset(session, key_filter=None, packed=False, multi_agent=False):
     """
-    Resets the Game to its default start position and returns the resulting obs_dict.
+    Resets the Game to its default start position and returns the resulting obs_dict (one per agent if
+    `multi_agent` is True; see compile_and_publish).
     """
     playing_world = util.get_playing_world()
     if not playing_world:
@@ -79,23 +108,331 @@ def reset(writer):
     # disable all rendering
     playing_world.get_game_viewport().game_viewport_client_set_rendering_flag(False)
 
-    # enqueue pausing the game for upcoming tick
-    asyncio.ensure_future(util.pause_game())
-    asyncio.ensure_future(get_and_send_obs_dict_async(writer, reward=0.0))
+    # wait for the upcoming tick (restarting the level happens there), then pause the game (or keep it running in
+    # free-running mode; the free runner must not touch the old level in the meantime)
+    free_runner.restarting = True
+    try:
+        await asyncio.sleep(0)
+    finally:
+        free_runner.restarting = False
+    # all cached uobject lookups are invalid now
+    util.bump_world_generation()
+    if free_runner.running:
+        GameplayStatics.SetGamePaused(playing_world, False)
+    else:
+        await util.pause_game()
+
+    agents = util.get_agent_controllers(playing_world) if multi_agent else None
+    return compile_and_publish(session, key_filter, packed, new_episode=True, agents=agents)
+
+
+def compile_and_publish(session, key_filter=None, packed=False, new_episode=False, agents=None):
+    """
+    Compiles the current observations into a frame, stores it as the last frame (for read-only sessions) and
+    returns the reply for the given session.
+
+    :param Session session: The session that triggered the compilation.
+    :param Union[util.KeyFilter,None] key_filter: The filter deciding which observation keys to evaluate.
+    :param bool packed: Whether to compile the non-image observations into the packed arrays.
+    :param bool new_episode: Whether a new episode was just started (resets all sessions' reward baselines).
+    :param Union[list,None] agents: The player controllers of all agents: If given, the reply is split up by agent
+        (see Session.reply_agents).
+    :return: A response dict to be sent back to the client.
+    :rtype: dict
+    """
+    trace = tracing.current
+    start = tracing.now_ns() if trace else 0
+    frame = util.compile_obs_dict(key_filter, packed)
+    if trace:
+        trace.add("compile", start)
+    if frame["status"] != "ok":
+        return frame
+    if obs_stats.enabled:
+        obs_stats.update(frame)
+    if new_episode:
+        sessions.new_episode(frame["world_id"])
+    sessions.publish(frame)
+    if agents is not None:
+        return session.reply_agents(frame, util.group_by_agent(frame, agents))
+    return session.reply(frame)
+
+
+def get_obs(message, session):
+    """
+    Returns the last frame compiled in the world given by the field `world` (default: the session option `world` or
+    0) without touching the engine (this is how read-only sessions get observations).
+    """
+    world_id = message.get("world", session.options.get("world", 0))
+    if not isinstance(world_id, int):
+        return {"status": "error", "message": "Field 'world' in 'get_obs' command is not an int!"}
+    frame = sessions.last_frames.get(world_id)
+    if frame is None:
+        return {"status": "error", "message": "No observations have been compiled in world {} yet!".format(world_id)}
+    return session.reply(frame)
+
 
+def get_stats(message, session):
+    """
+    Returns the running stats (count, min, max, mean, var, std; one value per element) of all numeric, non-image
+    observations compiled so far (`stats`: obs key -> stats) and whether the stats are being collected
+    (`collecting`). Collecting starts with the first `get_stats` command (or `get_spec` with `stats`=True) of the
+    controlling session, so that call returns no stats (unless some were loaded). Optional fields (`collect`, `save`,
+    `load` and `reset` are only allowed for the controlling session):
+    `collect` (bool): Start or stop collecting.
+    `keys` (list): Only return the stats of these keys.
+    `save` (str): Path of a file to store the stats in.
+    `load` (str): Path of a file (see `save`), whose stats are merged into ours before returning them.
+    `reset` (bool): Drop all stats after returning them.
+    """
+    for field in CONTROL_STATS_FIELDS:
+        if field in message and not session.is_controller:
+            return {"status": "error", "message": "Session {} is read-only and cannot use '{}' in 'get_stats'!".
+                    format(session.id, field)}
+    collect = message.get("collect", True)
+    if not isinstance(collect, bool):
+        return {"status": "error", "message": "Field 'collect' ({}) in 'get_stats' command is not a bool!".
+                format(collect)}
+    if session.is_controller and ("collect" in message or not obs_stats.enabled):
+        obs_stats.enabled = collect
+    merged = None
+    try:
+        if message.get("load"):
+            merged = obs_stats.load(message["load"])
+        if message.get("save"):
+            obs_stats.save(message["save"])
+    except (OSError, ValueError, KeyError) as e:
+        return {"status": "error", "message": "Loading/saving the observation stats failed ({})!".format(e)}
+
+    response = {"status": "ok", "num_frames": obs_stats.num_frames, "collecting": obs_stats.enabled,
+                "stats": obs_stats.get_stats(message.get("keys"))}
+    if merged is not None:
+        response["merged"] = merged
+    if message.get("reset"):
+        obs_stats.reset()
+    return response
+
+
+def get_trace(message, session):
+    """
+    Returns the recorded traces (see tracing.py) as Chrome trace events (`trace_events`) or - if the field `path` is
+    given - writes them into a Chrome trace-event JSON file. With `clear`=True, all recorded traces are dropped
+    afterwards. `path` and `clear` are only allowed for the controlling session.
+    """
+    for field in CONTROL_TRACE_FIELDS:
+        if field in message and not session.is_controller:
+            return {"status": "error", "message": "Session {} is read-only and cannot use '{}' in 'get_trace'!".
+                    format(session.id, field)}
+
+    response = {"status": "ok", "num_traces": len(tracing.traces)}
+    if message.get("path"):
+        try:
+            tracing.export(message["path"])
+        except OSError as e:
+            return {"status": "error", "message": "Exporting the traces failed ({})!".format(e)}
+    else:
+        response["trace_events"] = tracing.get_events()
+    if message.get("clear"):
+        tracing.traces.clear()
+    return response
+
+
+def get_memory(message, session):
+    """
+    Reports the memory usage of the server (see memory.py): `rss` (resident set size of the process in bytes), `gc`
+    (GC stats), `objects` (the render targets and scene-capture components created by the plugin: number created and
+    alive), `caches` (sizes of all server-side caches and buffers), `traced` (size of the python allocations while
+    tracemalloc is tracing) and `watchdog` (its stats). Optional fields:
+    `tracemalloc` (Union[bool,int]): Start (True or the number of frames per traceback) or stop (False) tracing.
+    `snapshot` (bool): Take a tracemalloc snapshot and return the largest allocations (`top`) and the largest growths
+        since the previous snapshot (`diff`), grouped by `group_by` (lineno|filename|traceback; default: lineno) and
+        `limit` (default: 20) entries each.
+    `watchdog` (Union[dict,bool]): Start (dict with `interval` in seconds and `threshold` in bytes) or stop (False)
+        the watchdog that logs a warning whenever the memory grew by more than the threshold.
+    """
+    for field in CONTROL_MEMORY_FIELDS:
+        if field in message and not session.is_controller:
+            return {"status": "error", "message": "Session {} is read-only and cannot use '{}' in 'memory'!".
+                    format(session.id, field)}
+
+    num_frames = message.get("tracemalloc")
+    if num_frames is True or (isinstance(num_frames, int) and not isinstance(num_frames, bool) and num_frames > 0):
+        memory.start_tracing(int(num_frames))
+    elif num_frames is False:
+        memory.stop_tracing()
+    elif num_frames is not None:
+        return {"status": "error", "message": "Field 'tracemalloc' ({}) in 'memory' command is not a bool or a "
+                                              "positive int!".format(num_frames)}
+
+    watchdog = message.get("watchdog")
+    if watchdog is False:
+        memory.watchdog.stop()
+    elif watchdog is not None:
+        interval, threshold = (watchdog.get("interval", 60), watchdog.get("threshold")) if \
+            isinstance(watchdog, dict) else (None, None)
+        if not isinstance(interval, (int, float)) or interval <= 0 or not isinstance(threshold, int) or threshold < 0:
+            return {"status": "error", "message": "Field 'watchdog' in 'memory' command needs to be False or a dict "
+                                                  "with a positive 'interval' (s) and an int 'threshold' (bytes)!"}
+        memory.watchdog.start(interval, threshold, get_cache_sizes)
+
+    response = {"status": "ok", "rss": memory.get_process_memory(), "gc": memory.get_gc_stats(),
+                "objects": memory.get_object_counts(), "caches": get_cache_sizes(), "traced": memory.get_traced(),
+                "watchdog": memory.watchdog.get_stats()}
+    if message.get("snapshot"):
+        group_by = message.get("group_by", "lineno")
+        if group_by not in ("lineno", "filename", "traceback"):
+            return {"status": "error", "message": "Field 'group_by' ({}) in 'memory' command needs to be lineno, "
+                                                  "filename or traceback!".format(group_by)}
+        try:
+            response["top"], response["diff"] = memory.take_snapshot(group_by, message.get("limit", 20))
+        except RuntimeError as e:
+            return {"status": "error", "message": "{}".format(e)}
+    return response
+
+
+def get_cache_sizes():
+    """
+    Returns: The sizes of all server-side caches and buffers (see `memory` command).
+    """
+    return {"server_utils": util.get_cache_sizes(), "last_frames": len(sessions.last_frames),
+            "sessions": {session.id: session.get_cache_sizes() for session in sessions.sessions.values()},
+            "scheduler_queue": len(scheduler.queue), "traces": len(tracing.traces),
+            "obs_stats_keys": len(obs_stats.keys)}
+
+
+def configure_session(message, session):
+    """
+    Changes the role of the session (`role`: control|observe) and/or merges in new session options (`options`).
+    The options `backpressure` (block|drop|disconnect), `high_watermark` and `low_watermark` (in bytes) configure
+    the session's output queue. With the option `out_of_band`=True, all numpy arrays (e.g. camera images) are sent
+    as raw buffers after the message (see framing.py). With the option `trace_sample`=N (a positive int; None to
+    stop sampling), every N-th request of the session is traced (see tracing.py). The option `world` sets the playing world the session's commands go to by
+    default (see run_in_world).
+    """
+    if "role" in message:
+        error = sessions.set_role(session, message["role"])
+        if error:
+            return {"status": "error", "message": error}
+    if "options" in message:
+        options = message["options"]
+        if not isinstance(options, dict):
+            return {"status": "error", "message": "Field 'options' in 'session' command is not a dict!"}
+        sample = options.get("trace_sample")
+        if sample is not None and (not isinstance(sample, int) or isinstance(sample, bool) or sample <= 0):
+            return {"status": "error", "message": "Option 'trace_sample' ({}) needs to be a positive int!".
+                    format(sample)}
+        error = session.output.configure(options.get("backpressure"), options.get("high_watermark"),
+                                         options.get("low_watermark"))
+        if error:
+            return {"status": "error", "message": error}
+        session.options.update(options)
+    return {"status": "ok", "session_id": session.id, "role": session.role, "options": session.options,
+            "output": session.output.get_stats()}
+
+
+def run(message, session, key_filter=None, packed=False):
+    """
+    Switches between lock-step mode (`mode`=lockstep; the default: the game is paused and only ticks during `step`)
+    and free-running mode (`mode`=realtime): The game ticks at its native rate, observations are sampled `rate`
+    times per second (default=30) and pushed to the client (as messages with field `push`=obs) and the most recent
+    action sent via the `act` command is applied at the next tick.
+    """
+    mode = message.get("mode", "lockstep")
+    if mode == "lockstep":
+        stats = free_runner.get_stats()
+        free_runner.stop()
+        stats["status"] = "ok"
+        return stats
+    elif mode != "realtime":
+        return {"status": "error", "message": "Unknown mode ({}) in 'run' command!".format(mode)}
+
+    rate = message.get("rate", 30)
+    if not isinstance(rate, (int, float)) or rate <= 0:
+        return {"status": "error", "message": "Field 'rate' ({}) in 'run' command is not a positive number!".format(rate)}
+    error = free_runner.start(session, rate, key_filter, packed)
+    if error:
+        return {"status": "error", "message": error}
+    return {"status": "ok", "mode": mode, "rate": rate}
+
+
+def act(message):
+    """
+    Hands an action (fields `axes` and `actions` like in the `step` command) to the free-running game. The action is
+    applied at the next tick. There is no reply (the next pushed observation will reflect the action).
+    """
+    if not free_runner.running:
+        return {"status": "error", "message": "'act' is only possible in free-running mode (see 'run' command)!"}
+    free_runner.act(message)
     return None
 
 
-async def get_and_send_obs_dict_async(writer, reward=0.0):
+def reload_server(warm_caches=True):
     """
-    Calls compile_obs_dict asynchronously and sends the message back via writer
+    Warm-reloads the server code (all RELOAD_MODULES and this module) without dropping any connections: The
+    listening server, all sessions and the scheduler are handed over to the freshly imported code (see
+    server_state). The caches of server_utils are carried over as far as they are still valid.
+    The objects carried over keep their classes (see RELOAD_MODULES). If any module fails to reload (e.g. a syntax
+    error in a hot fix), all modules are rolled back to the code they had before.
+
+    :param bool warm_caches: Whether to carry over the caches (False: start with cold caches).
+    :return: None if the reload succeeded, otherwise the error message.
+    :rtype: Union[str,None]
     """
-    message = util.compile_obs_dict(reward=reward)
-    send_message(message, writer)
+    start = time.perf_counter()
+    warm_state = util.get_warm_state()
+    snapshots = []  # (module, its globals before the reload)
+    try:
+        for name in RELOAD_MODULES:
+            snapshots.append((sys.modules[name], dict(sys.modules[name].__dict__)))
+            importlib.reload(sys.modules[name])
+        taken_over = sys.modules["server_utils"].set_warm_state(warm_state) if warm_caches else []
+        ue.log("Reloaded {} in {:.1f}ms (warm caches: {}).".
+               format(", ".join(RELOAD_MODULES), (time.perf_counter() - start) * 1000, taken_over))
+        snapshots.append((sys.modules[__name__], dict(globals())))
+        importlib.reload(sys.modules[__name__])
+    except Exception as e:
+        # (a reload executes the new code in the module's old namespace: put back what was there before)
+        for module, namespace in reversed(snapshots):
+            module.__dict__.clear()
+            module.__dict__.update(namespace)
+        ue.log_error("Reload failed, keeping the old code: {}: {}".format(type(e).__name__, e))
+        return "Reload failed ({}: {})! Keeping the old code.".format(type(e).__name__, e)
     return None
 
 
-def set_props(message):
+def subscribe(message, session):
+    """
+    Subscribes the session to all frames compiled from now on. The frames are pushed to the client (as messages
+    with field `push`=obs) without the client having to send any further commands.
+    Optional fields: `observers` (list of regexp patterns for the observer names to push; default: all) and
+    `max_rate` (max. number of frames per second to push; default: no limit).
+    A new subscription replaces an already existing one.
+    """
+    patterns = message.get("observers")
+    if patterns is not None and not isinstance(patterns, (list, tuple)):
+        return {"status": "error", "message": "Field 'observers' in 'subscribe' command is not a list of patterns!"}
+    max_rate = message.get("max_rate")
+    if max_rate is not None and (not isinstance(max_rate, (int, float)) or max_rate <= 0):
+        return {"status": "error", "message": "Field 'max_rate' ({}) in 'subscribe' command is not a positive number!".
+                format(max_rate)}
+
+    try:
+        subscription = Subscription(session, send_message, patterns, max_rate)
+    except re.error as e:
+        return {"status": "error", "message": "Malformatted observer pattern in 'subscribe' command ({})!".format(e)}
+    session.unsubscribe()
+    session.subscription = subscription
+    return {"status": "ok", "observers": patterns, "max_rate": max_rate}
+
+
+def unsubscribe(session):
+    stats = session.unsubscribe()
+    if stats is None:
+        return {"status": "error", "message": "Session {} has no subscription!".format(session.id)}
+    stats["status"] = "ok"
+    return stats
+
+
+def set_props(message, session, key_filter=None, packed=False):
     """
     Interface that allows us to set properties of different Actors/Components in the playing world.
     Arguments are passed in as a list (kwargs parameter: 'setters') of tuples:
@@ -116,14 +453,8 @@ def set_props(message):
 
     if "setters" not in message:
         return {"status": "error", "message": "Field 'setters' missing in 'set' command message!"}
-
-    actors = {}  # dict of uobjects: key=name (w/o number extension), value: list of actors that share this key (name)
-    for a in playing_world.all_actors():
-        name = re.sub(r'_\d+$', "", a.get_name(), 1)  # remove trailing _[digits]
-        if name not in actors:
-            actors[name] = [a]
-        else:
-            actors[name].append(a)
+    # (spawned or destroyed actors invalidate the resolved specifiers)
+    util.check_actors(playing_world)
 
     # DEBUG
     #pydevd.settrace("localhost", port=20023, stdoutToServer=True, stderrToServer=True)  # DEBUG
@@ -134,61 +465,110 @@ def set_props(message):
         if not isinstance(set_cmd, (list, tuple)) or len(set_cmd) < 2:
             return {"status": "error", "message": "Malformatted setter command {}. Needs to be ([actor:prop], [value][, is_relative]?).".format(set_cmd)}
         prop_spec, value, is_relative = set_cmd[0], set_cmd[1], False if len(set_cmd) < 3 else set_cmd[2]
-        uobjects = None  # the final uobject (could be an actor or a component or a component of a component, etc..)
-        while True:
-            mo = re.match(r':?(\w+)((:\w+)*)', prop_spec)
-            if not mo:
-                return {"status" : "error",
-                        "message": "Malformatted actor[:comp]?:property specifier ({}). "+
-                                   "Needs to be [actor-pattern[:comp-pattern(s)]*:property-pattern].".format(prop_spec)}
-            next_, prop_spec, _ = mo.groups()
-            # next_ is a pattern for actor names
-            if uobjects is None:
-                uobjects = []
-                # go through list of actors to collect the matching ones
-                for a, l in actors.items():
-                    if re.match(next_, a):
-                        uobjects.extend(l)  # playing_world.find_object(next_)
-            # next_ is a pattern for some sub-component of an Actor/other Component (still something left of the prop_spec)
-            elif prop_spec:
-                # go through list of uobjects to see whether they have components with the given name (next_)
-                uobjects_next = []
-                for uobj in uobjects:
-                    comps = uobj.get_actor_components()
-                    for comp in comps:
-                        if re.match(next_, comp.get_name()):
-                            uobjects_next.append(comp)  # playing_world.find_object(next_)
-                # update our list of matching components
-                uobjects = uobjects_next
-            # next_ is the name of the property
+        try:
+            uobjects, prop_name = util.resolve_prop_spec(prop_spec, playing_world)
+        except ValueError as e:
+            return {"status": "error", "message": "{}".format(e)}
+        # go through all collected uobjects and change the property
+        for uobj in uobjects:
+            if is_relative:
+                old_val = uobj.get_property(prop_name)
+                uobj.set_property(prop_name, old_val + value)
             else:
-                # go through all collected uobjects and change the property
-                for uobj in uobjects:
-                    print("trying to change uobj->{}".format(next_))
-                    if uobj.has_property(next_):
-                        if is_relative:
-                            old_val = uobj.get_property(next_)
-                            uobj.set_property(next_, old_val + value)
-                        else:
-                            uobj.set_property(next_, value)
-                break
+                uobj.set_property(prop_name, value)
+
+    return compile_and_publish(session, key_filter, packed)
 
-    return util.compile_obs_dict()
 
+def get_props(message, packed=False):
+    """
+    Reads the values of many properties of different Actors/Components in the playing world at once (without
+    stepping the game). Properties are given (field: 'getters') as a list of actor[:component(s)]*:prop-name
+    specifiers (same syntax as in the `set` command). The matching uobjects of each specifier are cached until the
+    set of actors changes (see server_utils.resolve_prop_spec).
+    Returns `values`: dict of specifier -> list of values (one per matching uobject) or, in packed mode, a single
+    float32 array (`values`) with all values and a `layout`: dict of specifier -> (offset, size per value, number of
+    values). With field `names`=True, the names of the matching uobjects are returned as well (`names`).
 
-def step(message):
+    :param dict message: The incoming message from the client.
+    :param bool packed: Whether to return the values as a single float32 array.
+    :return: A response dict to be sent back to the client.
+    :rtype: dict
+    """
+    playing_world = util.get_playing_world()
+    if not playing_world:
+        return {"status": "error", "message": "No playing world!"}
+    if "getters" not in message or not isinstance(message["getters"], (list, tuple)):
+        return {"status": "error", "message": "Field 'getters' missing in 'get' command message (or not a list)!"}
+    util.check_actors(playing_world)
+
+    values = {}
+    names = {} if message.get("names") else None
+    for prop_spec in message["getters"]:
+        try:
+            uobjects, prop_name = util.resolve_prop_spec(prop_spec, playing_world)
+            values[prop_spec] = [util.convert_property(uobj.get_property(prop_name)) for uobj in uobjects]
+        except (ValueError, TypeError) as e:
+            return {"status": "error", "message": "Getter {}: {}".format(prop_spec, e)}
+        if names is not None:
+            names[prop_spec] = [uobj.get_name() for uobj in uobjects]
+
+    response = {"status": "ok", "values": values}
+    if packed:
+        floats, layout = [], {}
+        for prop_spec, vals in values.items():
+            size = len(vals[0]) if vals and isinstance(vals[0], tuple) else 1
+            layout[prop_spec] = (len(floats), size, len(vals))
+            for val in vals:
+                if isinstance(val, str):
+                    return {"status": "error", "message": "Getter {}: Non-numeric values cannot be packed!".
+                            format(prop_spec)}
+                elif size > 1:
+                    floats.extend(val)
+                else:
+                    floats.append(val)
+        response["values"] = np.array(floats, dtype=np.float32)
+        response["layout"] = layout
+    if names is not None:
+        response["names"] = names
+    return response
+
+
+def step(message, session, key_filter=None, packed=False):
     """
     Performs a single step in the game (could be several ticks) given some action/axis mappings.
     The number of ticks to perform can be specified through `num_ticks` (default=4).
     The fake amount of time (dt) that each tick will use can be specified through `delta_time` (default=1/60s).
+    Multi-agent: `agents` holds one dict (with `axes` and `actions`) per player controller (agent index = controller
+    index). All inputs are applied before the shared ticks and the reply is split up by agent (see
+    Session.reply_agents). The same reply is returned if the session option `multi_agent` is set; then, top-level
+    `axes` and `actions` (w/o `agents`) go to the first agent (the default player controller).
     """
     playing_world = util.get_playing_world()
     if not playing_world:
         return {"status": "error", "message": "No playing world!"}
+    if free_runner.running:
+        return {"status": "error", "message": "Game is free-running: Use 'act' instead of 'step' (or 'run' with "
+                                              "mode=lockstep)!"}
 
     delta_time = message.get("delta_time", 1.0/60.0)  # the force-set delta time (dt) for each tick
     num_ticks = message.get("num_ticks", 4)  # the number of ticks to work through (all with the given action/axis mappings valid)
-    controller = playing_world.get_player_controller()
+    agents = message.get("agents")
+    controllers = None
+    if agents is not None or session.options.get("multi_agent"):
+        controllers = util.get_agent_controllers(playing_world)
+        if agents is None:
+            agents = [{"axes": message.get("axes"), "actions": message.get("actions")}] if controllers else []
+        elif "axes" in message or "actions" in message:
+            return {"status": "error", "message": "Fields 'axes'/'actions' in 'step' command cannot be combined with "
+                                                  "'agents' (put them into the agents' dicts)!"}
+        if not isinstance(agents, (list, tuple)) or len(agents) > len(controllers) or \
+                not all(isinstance(agent, dict) for agent in agents):
+            return {"status": "error", "message": "Field 'agents' in 'step' command needs to be a list of at most {} "
+                                                  "(the number of player controllers) dicts!".format(len(controllers))}
+        inputs = [(controllers[i], agent.get("axes"), agent.get("actions")) for i, agent in enumerate(agents)]
+    else:
+        inputs = [(util.get_player_controller(playing_world), message.get("axes"), message.get("actions"))]
 
     ue.log("step command: delta_time={} num_ticks={}".format(delta_time, num_ticks))
 
@@ -196,17 +576,17 @@ def step(message):
     #pydevd.settrace("localhost", port=20023, stdoutToServer=True, stderrToServer=True)  # DEBUG
     # END: DEBUG
 
-    if "axes" in message:
-        for axis in message["axes"]:
-            # ue.log("-> axis {}={} (key={})".format(key_name, axis[1], Key(KeyName=key_name)))
-            controller.input_axis(Key(KeyName=axis[0]), axis[1], delta_time)
-    if "actions" in message:
-        for action in message["actions"]:
-            # ue.log("-> action {}={}".format(action_name, action[1]))
-            controller.input_key(Key(KeyName=action[0]), EInputEvent.IE_Pressed if action[1] else EInputEvent.IE_Released)
+    trace = tracing.current
+    start = tracing.now_ns() if trace else 0
+    for controller, axes, actions in inputs:
+        util.apply_inputs(controller, axes, actions, delta_time)
+    if trace:
+        trace.add("inputs", start)
 
     # unpause the game and then perform n ticks with the given inputs (actions and axes)
     for i in range(num_ticks):
+        if trace:
+            start = tracing.now_ns()
         was_unpaused = GameplayStatics.SetGamePaused(playing_world, False)
         if not was_unpaused:
             ue.log_warning("Un-pausing game for next step was not successful!")
@@ -215,111 +595,325 @@ def step(message):
 
         # After the first tick, reset all action mappings to False again
         # (otherwise sending True in two succinct steps would not(!) repeat the action).
-        if i == 0 and "actions" in message:
-            for action in message["actions"]:
-                controller.input_key(Key(KeyName=action[0]), EInputEvent.IE_Released)
+        if i == 0:
+            for controller, _, actions in inputs:
+                if actions:
+                    util.release_actions(controller, actions)
 
         # pause again
         was_paused = GameplayStatics.SetGamePaused(playing_world, True)
         if not was_paused:
             ue.log_warning("Re-pausing game after step was not successful!")
+        if trace:
+            trace.add("tick:{}".format(i), start)
 
-    return util.compile_obs_dict()
+    return compile_and_publish(session, key_filter, packed, agents=controllers)
 
 
-def manage_message(message, writer):
+async def manage_message(message, session):
     """
     Handles all incoming message by forwarding the message to one of our command-handling functions (e.g. reset, step, etc..)
+    Commands that need the playing world go through the scheduler and are executed one after the other.
 
     :param dict message: The incoming message dict.
-    :param writer: The writer object to send async messages back to once done.
-    :return: A response dict to be sent back to the client.
-    :rtype: dict
+    :param Session session: The session the message came in from.
+    :return: A response dict to be sent back to the client (None if there is nothing to send back).
+    :rtype: Union[dict,None]
     """
     if "cmd" not in message:
         return {"status": "error", "message": "Field 'cmd' missing in message!"}
     cmd = message["cmd"]
-    if cmd == "step":
-        return step(message)
+    if cmd in CONTROL_COMMANDS and not session.is_controller:
+        return {"status": "error", "message": "Session {} is read-only and cannot call '{}'!".format(session.id, cmd)}
+    elif cmd in SCHEDULED_COMMANDS:
+        return await scheduler.submit(session, message)
+    elif cmd == "act":
+        return act(message)
+    elif cmd == "get_obs":
+        return get_obs(message, session)
+    elif cmd == "session":
+        return configure_session(message, session)
+    elif cmd == "subscribe":
+        return subscribe(message, session)
+    elif cmd == "unsubscribe":
+        return unsubscribe(session)
+    elif cmd == "get_stats":
+        return get_stats(message, session)
+    elif cmd == "get_trace":
+        return get_trace(message, session)
+    elif cmd == "memory":
+        return get_memory(message, session)
+
+    return {"status": "error", "message": "Unknown method ({}) to call!".format(cmd)}
+
+
+async def execute_command(session, message):
+    """
+    Executes a single (scheduled) command. Only ever called by the scheduler (one command at a time).
+    Traced commands (see handle_session) are made the `tracing.current` trace while they are executed.
+    """
+    trace = message.get("_trace")
+    if trace is None:
+        return await run_in_world(session, message)
+    tracing.current = trace
+    start = tracing.now_ns()
+    try:
+        return await run_in_world(session, message)
+    finally:
+        trace.add("execute", start)
+        tracing.current = None
+
+
+async def run_in_world(session, message):
+    """
+    Runs a single (scheduled) command in the playing world given by the field `world` (world id = env id; see
+    server_utils.get_playing_worlds). Default: the session option `world` or 0 (the first playing world).
+    """
+    world_id = message.get("world", session.options.get("world", 0))
+    if world_id == util.get_world_id():
+        return await run_command(session, message)
+    num_worlds = len(util.get_playing_worlds())
+    if not isinstance(world_id, int) or not 0 <= world_id < num_worlds:
+        return {"status": "error", "message": "Unknown world ({}): There are {} playing worlds!".
+                format(world_id, num_worlds)}
+    previous = util.select_world(world_id)
+    try:
+        return await run_command(session, message)
+    finally:
+        util.select_world(previous)
+
+
+async def run_command(session, message):
+    """
+    Runs a single (scheduled) command.
+    The commands returning an obs_dict accept the (optional) fields `include` and `exclude`: patterns of the
+    observation keys to evaluate/skip, and `packed` (bool): whether to return all non-image observations in two
+    arrays (`obs_floats`, `obs_bools`; see `packed_layout` in the spec). Defaults are taken from the session options.
+    `step` and `reset` with a `worlds` field are run in several playing worlds at once (see run_batched).
+
+    :param Session session: The session the command came in from.
+    :param dict message: The incoming message dict.
+    :return: A response dict to be sent back to the client.
+    :rtype: dict
+    """
+    cmd = message["cmd"]
+    key_filter = None
+    packed = message.get("packed", session.options.get("packed", False))
+    if cmd in ("step", "reset", "set", "run"):
+        try:
+            key_filter = util.get_key_filter(message.get("include", session.options.get("include")),
+                                             message.get("exclude", session.options.get("exclude")))
+        except (re.error, TypeError) as e:
+            return {"status": "error", "message": "Malformatted include/exclude pattern(s) in '{}' command ({})!".
+                    format(cmd, e)}
+
+    if cmd in BATCHED_COMMANDS and "worlds" in message:
+        return await run_batched(message, session, key_filter, packed)
+    elif cmd == "step":
+        return step(message, session, key_filter, packed)
     elif cmd == "reset":
-        return reset(writer)
+        return await reset(session, key_filter, packed, message.get("multi_agent", session.options.get("multi_agent")))
     elif cmd == "seed":
         return seed(message)
     elif cmd == "set":
-        return set_props(message)
+        return set_props(message, session, key_filter, packed)
+    elif cmd == "run":
+        return run(message, session, key_filter, packed)
+    elif cmd == "get":
+        return get_props(message, packed)
     elif cmd == "get_spec":
-        return util.get_spec()
+        # (`refresh`=True re-builds the spec, e.g. after input mappings were rebound at runtime; see get_spec_key)
+        spec = util.get_spec(refresh=message.get("refresh", False))
+        # the env id of the world and the number of envs (the cached spec itself stays untouched)
+        if spec["status"] == "ok":
+            spec = dict(spec, env_id=util.get_world_id(), num_envs=len(util.get_playing_worlds()))
+        # fold in the observation stats collected so far (e.g. as bounds for the Continuous spaces; from now on, the
+        # stats are collected if we are in control)
+        if message.get("stats"):
+            if session.is_controller:
+                obs_stats.enabled = True
+            return obs_stats.fold_into_spec(spec)
+        return spec
+    elif cmd == "reload":
+        error = reload_server(message.get("warm_caches", True))
+        if error:
+            return {"status": "error", "message": error}
+        return {"status": "ok"}
+
+
+async def run_batched(message, session, key_filter=None, packed=False):
+    """
+    Runs a `step` or `reset` in several playing worlds (`worlds`: list of world ids or "all") one after the other and
+    batches the replies into one: All reply fields are stacked along a new first axis (see batching.stack) in the
+    order of the batch's `env_ids` list. Per-world fields (e.g. the actions for `step`) go into `per_world`
+    (world id -> fields). Worlds that reply with an error are listed in `errors` (world id -> error message) and are
+    left out of the batch.
+    """
+    cmd = message["cmd"]
+    num_worlds = len(util.get_playing_worlds())
+    worlds = list(range(num_worlds)) if message["worlds"] == "all" else message["worlds"]
+    # (each world has its own packed arrays, but stepping a world twice would overwrite its first reply)
+    if not isinstance(worlds, (list, tuple)) or len(set(worlds)) != len(worlds) or \
+            not all(isinstance(world_id, int) and 0 <= world_id < num_worlds for world_id in worlds):
+        return {"status": "error", "message": "Field 'worlds' in '{}' command needs to be 'all' or a list of distinct "
+                                              "world ids (there are {} playing worlds)!".format(cmd, num_worlds)}
+    per_world = message.get("per_world") or {}
+    try:
+        per_world = {int(world_id): dict(fields) for world_id, fields in per_world.items()}
+    except (AttributeError, TypeError, ValueError):
+        return {"status": "error", "message": "Field 'per_world' in '{}' command is not a dict (world id -> fields)!".
+                format(cmd)}
 
-    return {"status": "error", "message": "Unknown method ({}) to call!".format(cmd)}
+    env_ids, replies, errors = [], [], {}
+    previous = util.get_world_id()
+    try:
+        for world_id in worlds:
+            util.select_world(world_id)
+            if cmd == "step":
+                reply = step(dict(message, **per_world.get(world_id, {})), session, key_filter, packed)
+            else:
+                reply = await reset(session, key_filter, packed, message.get("multi_agent",
+                                                                            session.options.get("multi_agent")))
+            if reply["status"] == "ok":
+                env_ids.append(world_id)
+                replies.append(reply)
+            else:
+                errors[world_id] = reply["message"]
+    finally:
+        util.select_world(previous)
 
+    batch = {"status": "ok" if env_ids else "error", "env_ids": env_ids, "errors": errors}
+    if not env_ids:
+        batch["message"] = "No world executed '{}'!".format(cmd)
+    else:
+        for field in set(replies[0]) - {"status", "env_id"}:
+            if all(field in reply for reply in replies):
+                batch[field] = stack([reply[field] for reply in replies])
+    return batch
 
-def send_message(message, writer):
-    message = msgpack.packb(message)
-    len_ = len(message)
-    # ue.log("Got message cmd={} -> sending response of len={}".format(message["cmd"], len_))
-    writer.write(bytes("{:08d}".format(len_), encoding="ascii") + message)  # prepend 8-byte len field to all our messages
+
+def send_message(message, session, droppable=False):
+    """
+    Packs a message and enqueues it in the session's output queue.
+    If the session uses out-of-band framing, the message's arrays are not copied but queued as memoryviews.
+
+    :param dict message: The message to send.
+    :param Session session: The session to send the message to.
+    :param bool droppable: Whether the message may be dropped if the client does not keep up (e.g. observation pushes).
+    :return: Whether the message was queued.
+    :rtype: bool
+    """
+    # ue.log("Got message cmd={} -> sending response".format(message.get("cmd")))
+    if session.options.get("out_of_band"):
+        return session.output.put(framing.pack_out_of_band(message, copy_keys=VOLATILE_FIELDS), droppable)
+    # prepend 8-byte len field to all our messages
+    return session.output.put(framing.pack(message), droppable)
 
 
 # this is called whenever a new client connects
 async def new_client_connected(reader, writer):
-    name = writer.get_extra_info("peername")
-    ue.log("New client connection from {0}".format(name))
-    unpacker = msgpack.Unpacker(encoding="utf-8")
+    session = sessions.open(reader, writer)
+    try:
+        await handle_session(session)
+    except ConnectionError as e:
+        ue.log("Connection to client {} lost ({}).".format(session.peername, e))
+    finally:
+        if free_runner.session is session:
+            free_runner.stop()
+        sessions.close(session)
+        writer.close()
+        ue.log("Client {0} disconnected (session {1})".format(session.peername, session.id))
+
+
+async def handle_session(session):
+    reader = session.reader
+    ue.log("New client connection from {0} (session {1}, role={2})".format(session.peername, session.id, session.role))
 
     # profile for n minutes after a connection
     #t = time.time()
     #last_prof = {}  # last time we profiled
 
     while True:
-        # wait for a line
-        data = await reader.read(8)  # read the num-byte header
-        if not data:
+        # wait for the num-byte header (may come in in several pieces)
+        try:
+            header = await reader.readexactly(framing.HEADER_LEN)
+        except asyncio.IncompleteReadError as e:
+            if e.partial:
+                ue.log_warning("Client {} disconnected in the middle of a message header.".format(session.peername))
+            break
+        receive_start = tracing.now_ns()
+        try:
+            orig_len = int(header)
+            if orig_len < 0:
+                raise ValueError()
+        except ValueError:
+            # we are out of sync with the client's stream (no way to find the start of the next message)
+            send_message({"status": "error", "message": "Malformatted message header ({})! Closing the connection.".
+                         format(header)}, session)
+            await session.output.flush()
             break
 
         # Read the incoming message.
-        orig_len = int(data)
-        received_len = 0
-        while True:
-            data = await reader.read(min(orig_len - received_len, 8192))
-            if not data:
-                send_message({"status": "error",
-                              "message": "No data of len {} received by socket.recv in call to method `recv`!".
-                             format(orig_len - received_len)}, writer)
-            data_len = len(data)
-            received_len += data_len
-            unpacker.feed(data)
-
-            if received_len == orig_len:
-                break
-
-        # Get the data.
-        for message in unpacker:
-            #response = None
-            if not isinstance(message, dict):
-                response = {"status": "error", "message": "Unknown message type ({})!".format(type(message).__name__)}
-            else:
-                #cmd = message.get("cmd")
-                #if cmd not in last_prof or t > last_prof[cmd] + 30:
-                #    pr = cProfile.Profile()
-                #    pr.enable()
-                #    response = manage_message(message, writer)
-                #    pr.disable()
-                #    s = io.StringIO()
-                #    ps = pstats.Stats(pr, stream=s).sort_stats("cumulative")
-                #    ps.dump_stats("prof.{}.{}".format(cmd, int(t)))
-                #    last_prof[cmd] = t
-                #else:
-                response = manage_message(message, writer)
-
-            # write back immediately
-            if response:
-                send_message(response, writer)
-            # async calls -> do nothing here (async will handle it)
+        try:
+            data = await reader.readexactly(orig_len)
+        except asyncio.IncompleteReadError as e:
+            ue.log_warning("Client {} disconnected after {} of {} bytes of a message.".
+                           format(session.peername, len(e.partial), orig_len))
+            break
+        receive_end = tracing.now_ns()
+
+        # Get the data (each frame holds exactly one message: a truncated or overlong body is an error of its own
+        # and must not leak into the next frame).
+        try:
+            message = msgpack.unpackb(data, encoding="utf-8")
+        except (ValueError, TypeError, msgpack.exceptions.UnpackException) as e:
+            send_message({"status": "error", "message": "Message could not be decoded ({})!".format(e)}, session)
+            continue
+        decode_end = tracing.now_ns()
+        #response = None
+        trace = None
+        if not isinstance(message, dict):
+            response = {"status": "error", "message": "Unknown message type ({})!".format(type(message).__name__)}
+        else:
+            #cmd = message.get("cmd")
+            #if cmd not in last_prof or t > last_prof[cmd] + 30:
+            #    pr = cProfile.Profile()
+            #    pr.enable()
+            #    response = manage_message(message, writer)
+            #    pr.disable()
+            #    s = io.StringIO()
+            #    ps = pstats.Stats(pr, stream=s).sort_stats("cumulative")
+            #    ps.dump_stats("prof.{}.{}".format(cmd, int(t)))
+            #    last_prof[cmd] = t
+            #else:
+            # only we set traces
+            message.pop("_trace", None)
+            trace = tracing.start(message, session, receive_start)
+            if trace is not None:
+                trace.add("receive", receive_start, receive_end)
+                trace.add("decode", receive_end, decode_end)
+                message["_trace"] = trace
+                dispatch_start = tracing.now_ns()
+            response = await manage_message(message, session)
+            if trace is not None:
+                trace.add("dispatch", dispatch_start)
+
+        if response is not None and trace is not None:
+            # the encoding of this reply can only be reported with the next traced reply (and in the export)
+            response = dict(response, _trace=dict(trace.to_dict(), prev_encode=session.last_encode_ns))
+            encode_start = tracing.now_ns()
+            send_message(response, session)
+            trace.add("encode", encode_start)
+            session.last_encode_ns = trace.spans[-1][2] - encode_start
+            tracing.record(trace)
+        elif response is not None:
+            send_message(response, session)
+        # don't execute any further commands as long as the client does not keep up with reading
+        if response is not None and session.output.policy == session.output.BLOCK:
+            await session.output.wait_writable()
 
         #t = time.time()
 
-    ue.log("Client {0} disconnected".format(name))
-
 
 # this spawns the server
 # the try/finally trick allows for gentle shutdown of the server
@@ -327,12 +921,15 @@ async def spawn_server(host, port):
     co_routine = None
     try:
         ue.log("Trying to start listen server on {0}:{1}.".format(host, port))
-        co_routine = await asyncio.start_server(new_client_connected, host, port)
+        co_routine = await asyncio.start_server(server_state.on_client_connected, host, port)
+        server_state.server = co_routine
         ue.log("Server spawned.")
         await co_routine.wait_closed()
     finally:
         if co_routine:
             co_routine.close()
+            if server_state.server is co_routine:
+                server_state.server = None
         ue.log("TCP server ended")
 
     
@@ -354,4 +951,40 @@ if not settings.Address:
     ue.log("No address set: Using default of {}.".format(settings.Address))
 
 ue.log("Address={} Port={}.".format(settings.Address, settings.Port))
-asyncio.ensure_future(spawn_server(settings.Address, settings.Port + port_add))
+
+# warm reload: take over the listening server, all sessions (and thereby all open connections) and the scheduler
+# and point them to the functions of this (freshly imported) module
+warm = server_state.is_running()
+if warm:
+    sessions = server_state.sessions
+    scheduler = server_state.scheduler
+    scheduler.execute = execute_command
+    free_runner = server_state.free_runner
+    free_runner.compile_and_publish, free_runner.send = compile_and_publish, send_message
+    obs_stats = server_state.obs_stats
+    for session in sessions.sessions.values():
+        if session.subscription is not None:
+            session.subscription.send = send_message
+    if memory.watchdog.running:
+        memory.watchdog.get_caches = get_cache_sizes
+# cold start
+else:
+    # cleanup previous tasks
+    server_state.shutdown()
+    ue.add_ticker(util.print_delta_time, 0)
+    sessions = server_state.sessions = SessionManager()
+    scheduler = server_state.scheduler = CommandScheduler(execute_command)
+    free_runner = server_state.free_runner = FreeRunner(compile_and_publish, send_message)
+    obs_stats = server_state.obs_stats = ObsStats()
+    # share the observation stats of earlier runs/other instances (see `get_stats` command) and go on collecting them
+    if os.environ.get("MARLENE_OBS_STATS") and os.path.isfile(os.environ["MARLENE_OBS_STATS"]):
+        obs_stats.enabled = True
+        ue.log("Loaded observation stats for {} keys from {}.".
+               format(len(obs_stats.load(os.environ["MARLENE_OBS_STATS"])), os.environ["MARLENE_OBS_STATS"]))
+    asyncio.ensure_future(spawn_server(settings.Address, settings.Port + port_add))
+
+server_state.module = sys.modules[__name__]
+server_state.num_loads += 1
+ue.log("marlene_server {} in {:.1f}ms (load #{}, {} open sessions).".
+       format("warm-reloaded" if warm else "started", (time.perf_counter() - _load_start) * 1000,
+              server_state.num_loads, len(sessions.sessions)))
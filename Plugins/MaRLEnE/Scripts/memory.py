@@ -0,0 +1,230 @@
+"""
+ -------------------------------------------------------------------------
+ MaRLEnE - memory.py
+
+ Memory instrumentation for long-running game instances: tracemalloc
+ snapshots (and their diffs by file/line), the uobjects created by the
+ plugin (render targets, scene-capture components), GC and process memory
+ stats and a watchdog that logs whenever the memory grew by more than a
+ threshold.
+ This module is not reloaded on warm reloads (see marlene_server), so its
+ counters, snapshots and the watchdog survive them.
+
+ created: 2026/10/19
+ -------------------------------------------------------------------------
+"""
+
+import unreal_engine as ue
+import asyncio
+import collections
+import gc
+import tracemalloc
+
+# the max. number of uobjects per kind that are kept to count how many of them are still alive
+MAX_TRACKED = 1024
+# the allocations tracemalloc should not report (its own and the import machinery's)
+SNAPSHOT_FILTERS = (tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+                    tracemalloc.Filter(False, "<unknown>"))
+
+# the number of uobjects created by the plugin (by kind) and the most recently created ones
+created = collections.Counter()
+_tracked = collections.defaultdict(lambda: collections.deque(maxlen=MAX_TRACKED))
+# the last snapshot taken via `take_snapshot` (the baseline of the next diff)
+_last_snapshot = None
+
+
+def track(kind, uobject):
+    """
+    Registers a uobject created by the plugin (e.g. kind="render_target").
+    Only the MAX_TRACKED most recent uobjects of each kind are kept (they don't keep the engine from destroying
+    them).
+    """
+    created[kind] += 1
+    _tracked[kind].append(uobject)
+
+
+def get_object_counts():
+    """
+    Returns: Dict of kind -> `created` (total number) and `alive` (the number of the MAX_TRACKED most recent ones that
+        are still valid).
+    """
+    return {kind: {"created": created[kind], "alive": sum(1 for uobject in uobjects if uobject.is_valid())}
+            for kind, uobjects in _tracked.items()}
+
+
+def get_gc_stats():
+    return {"counts": gc.get_count(), "thresholds": gc.get_threshold(), "generations": gc.get_stats(),
+            "garbage": len(gc.garbage), "num_objects": len(gc.get_objects())}
+
+
+def get_process_memory():
+    """
+    Returns: The resident set size of this process in bytes (None if it cannot be determined on this platform).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _get_page_size()
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+def _get_page_size():
+    import resource
+    return resource.getpagesize()
+
+
+def start_tracing(num_frames=1):
+    """
+    Starts tracing python allocations (with tracebacks of `num_frames` frames). Restarts a running trace if the
+    number of frames differs.
+    """
+    global _last_snapshot
+    if tracemalloc.is_tracing():
+        if tracemalloc.get_traceback_limit() == num_frames:
+            return
+        tracemalloc.stop()
+    _last_snapshot = None
+    tracemalloc.start(num_frames)
+
+
+def stop_tracing():
+    global _last_snapshot
+    _last_snapshot = None
+    tracemalloc.stop()
+
+
+def get_traced():
+    """
+    Returns: Dict with the `current` and `peak` size of the traced allocations (None if not tracing).
+    """
+    if not tracemalloc.is_tracing():
+        return None
+    current, peak = tracemalloc.get_traced_memory()
+    return {"current": current, "peak": peak, "num_frames": tracemalloc.get_traceback_limit()}
+
+
+def take_snapshot(group_by="lineno", limit=20):
+    """
+    Takes a tracemalloc snapshot and compares it with the previous one.
+
+    Args:
+        group_by (str): How to group the allocations (lineno, filename or traceback).
+        limit (int): The max. number of entries to return (each).
+
+    Returns: Tuple of: the largest allocations (list of dicts with `where`, `size`, `count`) and the largest growths
+        since the previous snapshot (same plus `size_diff`, `count_diff`; None if there is no previous snapshot).
+    Raises: RuntimeError if tracemalloc is not tracing.
+    """
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc is not tracing (start it via the 'tracemalloc' field)!")
+    snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+    top = [_stat_to_dict(stat) for stat in snapshot.statistics(group_by)[:limit]]
+    diff = None
+    if _last_snapshot is not None:
+        diff = [_stat_to_dict(stat) for stat in snapshot.compare_to(_last_snapshot, group_by)[:limit]]
+    _last_snapshot = snapshot
+    return top, diff
+
+
+def _stat_to_dict(stat):
+    stat_dict = {"where": [str(frame) for frame in stat.traceback] if len(stat.traceback) > 1 else
+                 str(stat.traceback[0]), "size": stat.size, "count": stat.count}
+    if isinstance(stat, tracemalloc.StatisticDiff):
+        stat_dict["size_diff"], stat_dict["count_diff"] = stat.size_diff, stat.count_diff
+    return stat_dict
+
+
+class Watchdog(object):
+    """
+    Periodically measures the memory (the traced python allocations while tracemalloc is tracing, the process' RSS
+    otherwise) and logs a warning (incl. the largest allocation growths and the cache sizes) whenever it grew by
+    more than a threshold since the last warning.
+    """
+    def __init__(self):
+        self.interval = None
+        self.threshold = None
+        self.get_caches = None
+        self.task = None
+        self.baseline = None
+        self.num_checks = 0
+        self.num_warnings = 0
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    def start(self, interval, threshold, get_caches=None):
+        """
+        Args:
+            interval (float): The number of seconds between two checks.
+            threshold (int): The growth (in bytes) that triggers a warning.
+            get_caches (Union[callable,None]): Function returning the sizes of the server's caches (logged with each
+                warning).
+        """
+        self.stop()
+        self.interval, self.threshold, self.get_caches = interval, threshold, get_caches
+        self.baseline = self.measure()
+        self.num_checks = self.num_warnings = 0
+        self.task = asyncio.ensure_future(self._run())
+        ue.log("Memory watchdog started (interval={}s threshold={} bytes).".format(interval, threshold))
+
+    def stop(self):
+        if self.running:
+            self.task.cancel()
+            ue.log("Memory watchdog stopped.")
+        self.task = None
+
+    def measure(self):
+        traced = get_traced()
+        return traced["current"] if traced is not None else get_process_memory()
+
+    def check(self):
+        """
+        Measures the memory and logs a warning if it grew by more than the threshold.
+
+        Returns: The growth since the last warning in bytes (None if the memory cannot be measured).
+        """
+        self.num_checks += 1
+        current = self.measure()
+        if current is None:
+            return None
+        if self.baseline is None:
+            self.baseline = current
+        growth = current - self.baseline
+        if growth > self.threshold:
+            self.num_warnings += 1
+            details = ""
+            if tracemalloc.is_tracing():
+                _, diff = take_snapshot(limit=10)
+                if diff is not None:
+                    details += " Largest growths: {}.".format(
+                        ", ".join("{} {:+d}B".format(d["where"], d["size_diff"]) for d in diff))
+            if self.get_caches is not None:
+                details += " Caches: {}.".format(self.get_caches())
+            ue.log_warning("Memory grew by {} bytes to {} bytes (objects: {}).{}".
+                           format(growth, current, get_object_counts(), details))
+            self.baseline = current
+        return growth
+
+    def get_stats(self):
+        return {"running": self.running, "interval": self.interval, "threshold": self.threshold,
+                "baseline": self.baseline, "num_checks": self.num_checks, "num_warnings": self.num_warnings}
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                ue.log_error("Memory watchdog check failed: {}".format(e))
+
+
+watchdog = Watchdog()
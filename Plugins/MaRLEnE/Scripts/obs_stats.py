@@ -0,0 +1,217 @@
+"""
+ -------------------------------------------------------------------------
+ MaRLEnE - obs_stats.py
+
+ Streaming statistics (count, min, max, mean, variance) over all numeric,
+ non-image observations of the compiled frames, such that clients can get
+ space bounds and normalization values from the server instead of running
+ their own warm-up rollouts.
+ Means and variances are updated in a single pass (Welford); stats
+ collected elsewhere (e.g. loaded from a file written by another instance)
+ are merged in with Chan's parallel formula.
+
+ created: 2026/10/19
+ -------------------------------------------------------------------------
+"""
+
+import json
+import numpy as np
+
+
+class RunningStats(object):
+    """
+    Element-wise running stats over a (flat) vector of values. Non-finite values are not counted.
+    """
+    def __init__(self, size):
+        self.count = np.zeros((size,), dtype=np.int64)
+        self.mean = np.zeros((size,), dtype=np.float64)
+        self.m2 = np.zeros((size,), dtype=np.float64)  # sum of squared differences from the mean
+        self.min = np.full((size,), np.inf)
+        self.max = np.full((size,), -np.inf)
+
+    def __len__(self):
+        return len(self.count)
+
+    def update(self, values):
+        """
+        Adds one sample (a vector of the same size as this object).
+        """
+        values = np.asarray(values, dtype=np.float64)
+        finite = np.isfinite(values)
+        if not finite.all():
+            values = np.where(finite, values, self.mean)
+        self.count += finite
+        delta = values - self.mean
+        self.mean += np.where(finite, delta / np.maximum(self.count, 1), 0.0)
+        self.m2 += np.where(finite, delta * (values - self.mean), 0.0)
+        np.minimum(self.min, np.where(finite, values, np.inf), out=self.min)
+        np.maximum(self.max, np.where(finite, values, -np.inf), out=self.max)
+
+    def merge(self, other, indices=slice(None)):
+        """
+        Merges the stats of another RunningStats object into (a slice of) this one.
+
+        Args:
+            other (RunningStats): The stats to merge in.
+            indices (slice): The elements of this object that correspond to the elements of `other`.
+        """
+        count_a, count_b = self.count[indices], other.count
+        count = count_a + count_b
+        safe_count = np.maximum(count, 1)
+        delta = other.mean - self.mean[indices]
+        self.mean[indices] += delta * count_b / safe_count
+        self.m2[indices] += other.m2 + delta ** 2 * count_a * count_b / safe_count
+        self.count[indices] = count
+        self.min[indices] = np.minimum(self.min[indices], other.min)
+        self.max[indices] = np.maximum(self.max[indices], other.max)
+
+    def slice(self, indices):
+        stats = RunningStats(0)
+        stats.count, stats.mean, stats.m2 = self.count[indices].copy(), self.mean[indices].copy(), \
+            self.m2[indices].copy()
+        stats.min, stats.max = self.min[indices].copy(), self.max[indices].copy()
+        return stats
+
+    def to_dict(self):
+        """
+        Returns: The (json-able) stats as lists (one entry per element): `count`, `min`, `max`, `mean`, `var`
+            (population variance) and `std`.
+        """
+        counted = self.count > 0
+        var = np.where(counted, self.m2 / np.maximum(self.count, 1), 0.0)
+        return {"count": self.count.tolist(), "min": np.where(counted, self.min, 0.0).tolist(),
+                "max": np.where(counted, self.max, 0.0).tolist(), "mean": self.mean.tolist(), "var": var.tolist(),
+                "std": np.sqrt(var).tolist()}
+
+    def get_state(self):
+        return {"count": self.count.tolist(), "mean": self.mean.tolist(), "m2": self.m2.tolist(),
+                "min": self.min.tolist(), "max": self.max.tolist()}
+
+    @staticmethod
+    def from_state(state):
+        stats = RunningStats(0)
+        stats.count = np.array(state["count"], dtype=np.int64)
+        stats.mean, stats.m2 = np.array(state["mean"], dtype=np.float64), np.array(state["m2"], dtype=np.float64)
+        stats.min, stats.max = np.array(state["min"], dtype=np.float64), np.array(state["max"], dtype=np.float64)
+        return stats
+
+
+class ObsStats(object):
+    """
+    The running stats of all numeric, non-image observation keys.
+    Packed frames update one RunningStats over the whole float32 array (vectorized), all other frames update
+    one RunningStats per key. Both are merged when the stats are queried.
+    Frames are only collected while `enabled` is set (the server turns it on as soon as someone asks for the stats).
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.keys = {}  # obs key -> RunningStats
+        self.packed = None  # RunningStats over the packed floats of the current layout
+        self.packed_layout = None
+        self.num_frames = 0
+
+    def reset(self):
+        self.keys.clear()
+        self.packed = self.packed_layout = None
+        self.num_frames = 0
+
+    def update(self, frame):
+        """
+        Adds the observations of a compiled frame (see server_utils.compile_obs_dict).
+        """
+        if frame["status"] != "ok":
+            return
+        self.num_frames += 1
+        if frame["packed"] is not None:
+            floats, _, layout = frame["packed"]
+            # partial frames: the slots of skipped keys hold stale values -> only update the evaluated keys
+            if frame["partial"]:
+                key_filter = frame["key_filter"]
+                for key, (offset, size) in layout["floats"].items():
+                    if key_filter(key):
+                        self._get(key, size).update(floats[offset:offset+size])
+            else:
+                # (several playing worlds share equal layouts)
+                if layout is not self.packed_layout and layout != self.packed_layout:
+                    self._fold_packed()
+                    self.packed, self.packed_layout = RunningStats(layout["num_floats"]), layout
+                self.packed.update(floats)
+
+        for key, value in frame["obs_dict"].items():
+            if key.endswith("/camera") or isinstance(value, (bool, str)):
+                continue
+            if isinstance(value, (int, float)):
+                self._get(key, 1).update((value,))
+            elif isinstance(value, (tuple, list)):
+                self._get(key, len(value)).update(value)
+
+    def get_stats(self, keys=None):
+        """
+        Args:
+            keys (Union[iterable,None]): The keys to return the stats for (None for all).
+
+        Returns: Dict of obs key -> stats (see RunningStats.to_dict).
+        """
+        self._fold_packed()
+        return {key: stats.to_dict() for key, stats in self.keys.items() if keys is None or key in keys}
+
+    def save(self, path):
+        self._fold_packed()
+        with open(path, "w") as f:
+            json.dump({"num_frames": self.num_frames, "keys": {k: s.get_state() for k, s in self.keys.items()}}, f)
+
+    def load(self, path):
+        """
+        Merges the stats stored in a file (see `save`) into ours (keys whose size does not match are ignored).
+
+        Returns: The list of merged keys.
+        """
+        with open(path) as f:
+            state = json.load(f)
+        self._fold_packed()
+        merged = []
+        for key, key_state in state["keys"].items():
+            stats = RunningStats.from_state(key_state)
+            if key in self.keys and len(self.keys[key]) != len(stats):
+                continue
+            self._get(key, len(stats)).merge(stats)
+            merged.append(key)
+        self.num_frames += state.get("num_frames", 0)
+        return merged
+
+    def _get(self, key, size):
+        stats = self.keys.get(key)
+        if stats is None or len(stats) != size:
+            stats = self.keys[key] = RunningStats(size)
+        return stats
+
+    def _fold_packed(self):
+        # merges the vectorized stats of the packed floats into the per-key stats
+        if self.packed is None:
+            return
+        for key, (offset, size) in self.packed_layout["floats"].items():
+            self._get(key, size).merge(self.packed.slice(slice(offset, offset+size)))
+        self.packed = RunningStats(len(self.packed))
+
+    def fold_into_spec(self, spec):
+        """
+        Returns a copy of the spec (the cached one stays untouched), in which the descriptors of all Continuous and
+        (non-image) IntBox observations additionally carry the collected stats (`min`, `max` - unless given by the
+        spec already -, `mean`, `std` and `num_samples`; one value per element).
+        """
+        if spec["status"] != "ok":
+            return spec
+        stats = self.get_stats()
+        spec = dict(spec)
+        spec["observation_space_desc"] = obs_space_desc = dict(spec["observation_space_desc"])
+        for key, desc in obs_space_desc.items():
+            if key not in stats or desc["type"] not in ("Continuous", "IntBox") or key.endswith("/camera"):
+                continue
+            key_stats = stats[key]
+            if min(key_stats["count"]) == 0:
+                continue
+            desc = obs_space_desc[key] = dict(desc)
+            desc.setdefault("min", key_stats["min"])
+            desc.setdefault("max", key_stats["max"])
+            desc["mean"], desc["std"], desc["num_samples"] = key_stats["mean"], key_stats["std"], min(key_stats["count"])
+        return spec
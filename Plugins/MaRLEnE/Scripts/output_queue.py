@@ -0,0 +1,203 @@
+"""
+ -------------------------------------------------------------------------
+ MaRLEnE - output_queue.py
+
+ Bounded per-connection output queue: Messages to a client are written
+ to the transport right away as long as the client keeps up; otherwise
+ they are queued and written out (awaiting the transport's drain) by the
+ queue's own task. Slow clients are handled according to the queue's
+ policy once the queued bytes go above the high watermark.
+
+ created: 2026/10/19
+ -------------------------------------------------------------------------
+"""
+
+import unreal_engine as ue
+import asyncio
+import collections
+
+
+class OutputQueue(object):
+    """
+    Policies (what happens if the queued bytes go above the high watermark):
+    - block: The session stops reading (and thus executing) further commands until the queue is below the low
+        watermark again. Droppable messages (observation pushes) are dropped.
+    - drop: Droppable messages (already queued ones as well as new ones) are dropped. Replies are always queued.
+    - disconnect: The connection is closed.
+    The queued bytes include those still buffered by the transport.
+    """
+
+    BLOCK = "block"
+    DROP = "drop"
+    DISCONNECT = "disconnect"
+    POLICIES = (BLOCK, DROP, DISCONNECT)
+
+    def __init__(self, writer, policy=BLOCK, high_watermark=16 * 1024 * 1024, low_watermark=4 * 1024 * 1024):
+        """
+        Args:
+            writer (asyncio.StreamWriter): The writer of the client connection.
+            policy (str): One of POLICIES.
+            high_watermark (int): The number of queued bytes above which the policy kicks in.
+            low_watermark (int): The number of queued bytes below which a blocked session may continue.
+        """
+        self.writer = writer
+        self.policy = policy
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.queue = collections.deque()  # items: (data, num_bytes, droppable)
+        self.closed = False
+
+        # counters
+        self.bytes_queued = 0  # including the message currently being written
+        self.max_bytes_queued = 0
+        self.bytes_sent = 0
+        self.num_dropped = 0
+        self.bytes_dropped = 0
+
+        self._has_data = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._flushed = asyncio.Event()
+        self._flushed.set()
+        self.task = asyncio.ensure_future(self._run())
+
+    def configure(self, policy=None, high_watermark=None, low_watermark=None):
+        """
+        Changes policy and/or watermarks.
+
+        Returns: An error message if the settings are invalid, None otherwise.
+        """
+        policy = self.policy if policy is None else policy
+        high_watermark = self.high_watermark if high_watermark is None else high_watermark
+        low_watermark = self.low_watermark if low_watermark is None else low_watermark
+        if policy not in self.POLICIES:
+            return "Unknown backpressure policy ({})! Needs to be one of {}.".format(policy, self.POLICIES)
+        if not isinstance(high_watermark, int) or not isinstance(low_watermark, int) or \
+                not 0 <= low_watermark <= high_watermark:
+            return "Watermarks need to be ints with 0 <= low ({}) <= high ({})!".format(low_watermark, high_watermark)
+        self.policy, self.high_watermark, self.low_watermark = policy, high_watermark, low_watermark
+        return None
+
+    def is_congested(self):
+        return self.bytes_queued + self._get_buffered() > self.high_watermark
+
+    def put(self, data, droppable=False):
+        """
+        Enqueues a message for sending.
+
+        Args:
+            data (Union[bytes,list]): The fully framed message or the list of its chunks (e.g. the memoryviews of
+                out-of-band arrays; see framing.pack_out_of_band), which are written without being joined.
+            droppable (bool): Whether the message may be dropped in case the client does not keep up (e.g. an
+                observation push that will soon be superseded by a newer one).
+
+        Returns: Whether the message was queued.
+        """
+        if self.closed:
+            return False
+        if self.writer.transport.is_closing():
+            self.close()
+            return False
+        num_bytes = sum(len(chunk) for chunk in data) if isinstance(data, list) else len(data)
+        buffered = self._get_buffered()
+        if self.bytes_queued + buffered + num_bytes > self.high_watermark:
+            if self.policy == self.DISCONNECT:
+                ue.log_warning("Client {} does not keep up ({} bytes queued): Disconnecting.".
+                               format(self.writer.get_extra_info("peername"), self.bytes_queued))
+                self.close()
+                self.writer.close()
+                return False
+            elif droppable:
+                self._drop(num_bytes)
+                return False
+            elif self.policy == self.DROP:
+                self._drop_stale()
+        # nothing queued and the transport keeps up: write right away (a hop through our task would cost an engine
+        # tick)
+        elif self.bytes_queued == 0:
+            self._write(data)
+            self.bytes_sent += num_bytes
+            self.max_bytes_queued = max(self.max_bytes_queued, buffered + num_bytes)
+            return True
+
+        self.queue.append((data, num_bytes, droppable))
+        self._flushed.clear()
+        self.bytes_queued += num_bytes
+        self.max_bytes_queued = max(self.max_bytes_queued, self.bytes_queued + buffered)
+        if self.bytes_queued + buffered > self.high_watermark:
+            self._writable.clear()
+        self._has_data.set()
+        return True
+
+    async def wait_writable(self):
+        """
+        Waits until the queued bytes are below the low watermark again (after having been above the high watermark).
+        """
+        await self._writable.wait()
+
+    async def flush(self, timeout=1.0):
+        """
+        Waits until all queued messages are written (at most `timeout` seconds), e.g. before closing the connection.
+        """
+        try:
+            await asyncio.wait_for(self._flushed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def close(self):
+        self.closed = True
+        self.task.cancel()
+        self.queue.clear()
+        # don't leave a blocked or flushing session hanging
+        self._writable.set()
+        self._flushed.set()
+
+    def get_stats(self):
+        return {"policy": self.policy, "high_watermark": self.high_watermark, "low_watermark": self.low_watermark,
+                "bytes_queued": self.bytes_queued, "max_bytes_queued": self.max_bytes_queued,
+                "bytes_sent": self.bytes_sent, "num_dropped": self.num_dropped, "bytes_dropped": self.bytes_dropped}
+
+    def _get_buffered(self):
+        # the number of bytes written to the transport but not sent yet
+        return self.writer.transport.get_write_buffer_size()
+
+    def _write(self, data):
+        if isinstance(data, list):
+            self.writer.writelines(data)
+        else:
+            self.writer.write(data)
+
+    def _drop(self, num_bytes):
+        self.num_dropped += 1
+        self.bytes_dropped += num_bytes
+
+    def _drop_stale(self):
+        kept = collections.deque()
+        for item in self.queue:
+            if item[2]:
+                self._drop(item[1])
+                self.bytes_queued -= item[1]
+            else:
+                kept.append(item)
+        self.queue = kept
+
+    async def _run(self):
+        try:
+            while True:
+                await self._has_data.wait()
+                while self.queue:
+                    data, num_bytes, _ = self.queue.popleft()
+                    self._write(data)
+                    await self.writer.drain()
+                    self.bytes_queued -= num_bytes
+                    self.bytes_sent += num_bytes
+                    if self.bytes_queued <= self.low_watermark:
+                        self._writable.set()
+                self._has_data.clear()
+                self._flushed.set()
+        except ConnectionError as e:
+            ue.log("Writing to client {} failed ({}).".format(self.writer.get_extra_info("peername"), e))
+            self.closed = True
+            self.queue.clear()
+            self._writable.set()
+            self._flushed.set()
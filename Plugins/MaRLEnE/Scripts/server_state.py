@@ -0,0 +1,61 @@
+"""
+ -------------------------------------------------------------------------
+ MaRLEnE - server_state.py
+
+ State of the running server that has to survive a (warm) reload of
+ marlene_server.py: the listening server, the sessions (and with them all
+ open client connections), the scheduler, the free runner and the
+ collected observation stats.
+ This module itself must never be reloaded.
+
+ created: 2026/10/19
+ -------------------------------------------------------------------------
+"""
+
+import asyncio
+
+
+# the asyncio.Server listening for incoming connections
+server = None
+# the currently loaded server module (marlene_server): new connections are always handed to it
+module = None
+# the SessionManager, CommandScheduler, FreeRunner and ObsStats of the running server
+sessions = None
+scheduler = None
+free_runner = None
+obs_stats = None
+# how often marlene_server has been loaded into this process
+num_loads = 0
+
+
+def on_client_connected(reader, writer):
+    """
+    The callback of the listening server (dispatches to the currently loaded server module).
+    """
+    return module.new_client_connected(reader, writer)
+
+
+def is_running():
+    return sessions is not None
+
+
+def shutdown():
+    """
+    Cold shutdown: Closes the listening server and cancels all tasks (dropping all connections).
+    """
+    global server, sessions, scheduler, free_runner, obs_stats
+    if free_runner is not None:
+        free_runner.stop()
+    if server is not None:
+        server.close()
+    server = sessions = scheduler = free_runner = obs_stats = None
+
+    for task in get_all_tasks():
+        task.cancel()
+
+
+def get_all_tasks():
+    # (asyncio.Task.all_tasks is gone since python 3.9)
+    if hasattr(asyncio, "all_tasks"):
+        return asyncio.all_tasks(asyncio.get_event_loop())
+    return asyncio.Task.all_tasks()
@@ -11,39 +11,409 @@
 
 import unreal_engine as ue
 from unreal_engine.classes import MLObserver, GameplayStatics, GeneralProjectSettings, CameraComponent, InputSettings, SceneCaptureComponent2D
+from unreal_engine.structs import Key
+from unreal_engine.enums import EInputEvent
 import unreal_engine.classes
 import numpy as np
 import re
+import json
+import tracing
+import memory
+import ue_asyncio
+import hashlib
 
+# compiled KeyFilters by their (include, exclude) patterns (see get_key_filter)
+_KEY_FILTERS = {}
+_MAX_KEY_FILTERS = 64
 
-# TODO: global observation_dict (init only once, then write to it in place) to save on garbage collection runs
-_OBS_DICT = {}
+# the caches of all playing worlds by world id (env id; see get_playing_worlds) and the id of the world all functions
+# of this module currently work on (see select_world)
+_WORLD_CACHES = {}
+_WORLD_ID = 0
+# the playing worlds found last and the engine tick they were found in (worlds are only searched once per tick)
+_PLAYING_WORLDS = []
+_PLAYING_WORLDS_TICK = None
+# the registered MLObservers (of all worlds) found last and their generation: bumped whenever an observer is
+# registered or unregistered (see get_observers)
+_OBSERVERS = ()
+_OBSERVER_GENERATION = 0
+# Key structs by key name (see get_key)
+_KEYS = {}
+_MAX_KEYS = 1024
 
+_MAX_RESOLVED_PROP_SPECS = 4096
 
-# search for the currently running world
-def get_playing_world():
+# the max. number of player controllers (agents) per world and the max. number of owner-levels to go up from an
+# observer's owner to find the agent (controller or pawn) it belongs to (see group_by_agent)
+MAX_AGENTS = 64
+MAX_OWNER_DEPTH = 4
+
+
+class WorldCache(object):
+    """
+    Everything cached for one playing world (env).
+    """
+    def __init__(self):
+        # the uworld these caches belong to and its generation: bumped whenever the world changes or its level is
+        # restarted (all cached uobject lookups are only valid within one generation)
+        self.world = None
+        self.generation = 0
+        # the cached spec (see get_spec), the key it was computed for and its short hash (sent along with every
+        # obs_dict)
+        self.spec = None
+        self.spec_key = None
+        self.spec_hash = None
+        # the preallocated arrays that all non-image observations get written into in packed mode (see
+        # compile_obs_dict): float32 for FVector/FRotator, float and int properties, int8 for bools. Their layout is
+        # published in the spec.
+        self.packed_floats = np.zeros((0,), dtype=np.float32)
+        self.packed_bools = np.zeros((0,), dtype=np.int8)
+        # the uobject handles resolved once per generation (all of them are dropped when the generation changes; see
+        # check_generation): the (first) player controller, all player controllers (agents; see
+        # get_agent_controllers), the action- and axis-mappings (see get_spec_key), the actors of the world
+        # and their index (actor names w/o number extension -> actors; both also re-built whenever the set of actors
+        # changes, see check_actors) and the resolved actor[:component]*:property specifiers (see resolve_prop_spec)
+        self.controller = None
+        self.controllers = None
+        self.mappings = None
+        self.actors = None
+        self.actor_index = None
+        self.resolved_prop_specs = {}
+        self.resolved_generation = None
+        # the sanity-checked observers of this world (list of (observer, owner, name) tuples), the tuple of these
+        # observers (see get_spec_key) and the observer generation they were resolved in (see get_observers)
+        self.observers = None
+        self.observer_set = None
+        self.observers_generation = None
+
+    def check_generation(self):
+        """
+        Drops all uobject handles that were resolved in an earlier generation.
+        """
+        if self.resolved_generation != self.generation:
+            self.controller = self.controllers = self.mappings = self.actors = self.actor_index = None
+            self.resolved_prop_specs.clear()
+            self.observers = self.observer_set = self.observers_generation = None
+            self.resolved_generation = self.generation
+
+
+def get_world_cache():
+    """
+    Returns: The WorldCache of the selected world (see select_world) w/o any handles of earlier generations.
+    """
+    cache = _WORLD_CACHES.get(_WORLD_ID)
+    if cache is None:
+        cache = _WORLD_CACHES[_WORLD_ID] = WorldCache()
+    cache.check_generation()
+    return cache
+
+
+def get_playing_worlds():
     """
     UE4 world types:
     None=0, Game=1, Editor=2, PIE=3, EditorPreview=4, GamePreview=5, Inactive=6
 
+    Worlds are only searched once per engine tick (worlds are created and destroyed in between ticks) or if one of
+    the worlds found last is gone.
+
+    Returns: The list of all worlds that are either a Game OR a PIE (play in editor) world (e.g. one per PIE client).
+        A world's index in this list is its world id (env id), which stays the same as long as no world is added or
+        removed.
+    """
+    global _PLAYING_WORLDS, _PLAYING_WORLDS_TICK
+    if _PLAYING_WORLDS_TICK == ue_asyncio.ticks and all(world.is_valid() for world in _PLAYING_WORLDS):
+        return _PLAYING_WORLDS
+    worlds = [world for world in ue.all_worlds() if world.get_world_type() in (1, 3)]  # game or pie
+    _PLAYING_WORLDS, _PLAYING_WORLDS_TICK = worlds, ue_asyncio.ticks
+    # drop the caches of worlds that are gone
+    for world_id in [world_id for world_id in _WORLD_CACHES if world_id >= len(worlds)]:
+        del _WORLD_CACHES[world_id]
+    return worlds
+
+
+def get_world_id():
+    return _WORLD_ID
+
+
+def select_world(world_id):
+    """
+    Makes all functions of this module work on another playing world (see get_playing_worlds).
+
+    Args:
+        world_id (int): The id of the world to select.
+
+    Returns: The id of the previously selected world (to restore the selection afterwards).
+    """
+    global _WORLD_ID
+    previous, _WORLD_ID = _WORLD_ID, world_id
+    return previous
+
+
+# search for the currently running world
+def get_playing_world():
+    """
     :return: Returns the currently playing UE4 world.Returns the currently playing UE4 world.
-    Returns the first world within all worlds that is either a Game OR and PIE (play in editor) world.
+    Returns the selected world (see select_world) of all Game and PIE worlds (see get_playing_worlds).
     :rtype: UnrealEnginePython UWorld
     """
     # DEBUG
     #pydevd.settrace("localhost", port=20023, stdoutToServer=True, stderrToServer=True)  # DEBUG
     # END: DEBUG
 
-    playing_world = None
-    for world in ue.all_worlds():
-        if world.get_world_type() in (1, 3):  # game or pie
-            playing_world = world
-            break
+    worlds = get_playing_worlds()
+    playing_world = worlds[_WORLD_ID] if _WORLD_ID < len(worlds) else None
     # DEBUG: I want to know whether the world changes after reset, etc...
     #ue.log("DEBUG: playing world: {}".format(playing_world))
+    cache = get_world_cache()
+    if playing_world != cache.world:
+        bump_world_generation()
+        # (also remembers that there is no playing world anymore, so that this bumps only once)
+        cache.world = playing_world
     return playing_world
 
 
+def bump_world_generation():
+    """
+    Starts a new generation of the selected world, which invalidates all its cached uobject handles (e.g. after the
+    level was restarted or the playing world changed; see WorldCache).
+    """
+    get_world_cache().generation += 1
+
+
+def get_world_generation():
+    return get_world_cache().generation
+
+
+def get_player_controller(playing_world):
+    """
+    Returns: The (first) player controller of the playing world (looked up once per generation).
+    """
+    cache = get_world_cache()
+    if cache.controller is None:
+        cache.controller = playing_world.get_player_controller()
+    return cache.controller
+
+
+def get_observers(playing_world):
+    """
+    Returns the observers of the playing world (those of other worlds and those w/o an owner are left out).
+    Only fetches the registered MLObservers each time: The observers are only sanity-checked (see
+    sanity_check_observer) once per generation of the world and of the registered observers. Afterwards, only their
+    validity is checked (destroyed observers stay registered until they are garbage collected).
+
+    Args:
+        playing_world (uworld): The UWorld object of the running Game.
+
+    Returns: List of (observer, owner, observer name) tuples.
+    """
+    global _OBSERVERS, _OBSERVER_GENERATION
+    observers = tuple(MLObserver.GetRegisteredObservers())
+    if observers != _OBSERVERS:
+        _OBSERVERS = observers
+        _OBSERVER_GENERATION += 1
+    cache = get_world_cache()
+    if cache.observers_generation != _OBSERVER_GENERATION:
+        cache.observers = []
+        for observer in observers:
+            owner, obs_name = sanity_check_observer(observer, playing_world)
+            if owner:
+                cache.observers.append((observer, owner, obs_name))
+        cache.observer_set = tuple(observer for observer, _, _ in cache.observers)
+        cache.observers_generation = _OBSERVER_GENERATION
+    return [handle for handle in cache.observers if handle[0].is_valid()]
+
+
+def get_key(key_name):
+    """
+    Returns: The (cached) Key struct for the given key name.
+    """
+    key = _KEYS.get(key_name)
+    if key is None:
+        if len(_KEYS) >= _MAX_KEYS:
+            _KEYS.clear()
+        key = _KEYS[key_name] = Key(KeyName=key_name)
+    return key
+
+
+def get_actor_index(playing_world, all_actors=None):
+    """
+    Args:
+        playing_world (uworld): The UWorld object of the running Game.
+        all_actors (Union[iterable,None]): All actors of the world (if already fetched by the caller).
+
+    Returns: A dict of all actors in the world: key=name (w/o number extension), value: list of actors that share
+        this key (name).
+    """
+    actors = {}
+    for a in playing_world.all_actors() if all_actors is None else all_actors:
+        name = re.sub(r'_\d+$', "", a.get_name(), 1)  # remove trailing _[digits]
+        if name not in actors:
+            actors[name] = [a]
+        else:
+            actors[name].append(a)
+    return actors
+
+
+def check_actors(playing_world):
+    """
+    Drops the actor index and all resolved property specifiers of the selected world if its set of actors changed
+    (actors were spawned or destroyed) since the last call. Called once per `get`/`set` command.
+
+    Args:
+        playing_world (uworld): The UWorld object of the running Game.
+    """
+    cache = get_world_cache()
+    actors = tuple(playing_world.all_actors())
+    if actors != cache.actors:
+        cache.actors = actors
+        cache.actor_index = get_actor_index(playing_world, actors)
+        cache.resolved_prop_specs.clear()
+
+
+def resolve_prop_spec(prop_spec, playing_world):
+    """
+    Resolves an actor[:comp]*:property specifier (each part being a regexp pattern for the beginning of the actor,
+    component or property name) into the list of matching uobjects that have the property.
+    Results are cached until the set of actors of the selected world changes (see check_actors) or a new generation
+    starts (see bump_world_generation). Destroyed uobjects are left out of cached results, but components added to
+    already existing actors are only found once the set of actors changes (or after the next reset).
+
+    Args:
+        prop_spec (str): The specifier, e.g. "Player:Mesh:RelativeLocation".
+        playing_world (uworld): The UWorld object of the running Game.
+
+    Returns: Tuple of (list of matching uobjects, property name).
+    Raises: ValueError if the specifier is malformatted.
+    """
+    cache = get_world_cache()
+    resolved = cache.resolved_prop_specs.get(prop_spec)
+    if resolved is not None:
+        return [uobj for uobj in resolved[0] if uobj.is_valid()], resolved[1]
+
+    if cache.actor_index is None:
+        check_actors(playing_world)
+
+    uobjects = None  # the final uobjects (could be actors or components or components of components, etc..)
+    rest = prop_spec
+    while True:
+        mo = re.match(r':?(\w+)((:\w+)*)', rest) if isinstance(rest, str) else None
+        if not mo:
+            raise ValueError("Malformatted actor[:comp]?:property specifier ({}). Needs to be "
+                             "[actor-pattern[:comp-pattern(s)]*:property-pattern].".format(prop_spec))
+        next_, rest, _ = mo.groups()
+        # next_ is a pattern for actor names
+        if uobjects is None:
+            uobjects = []
+            # go through list of actors to collect the matching ones
+            for name, actors in cache.actor_index.items():
+                if re.match(next_, name):
+                    uobjects.extend(actors)
+            if not rest:
+                raise ValueError("Property specifier {} has no property name!".format(prop_spec))
+        # next_ is a pattern for some sub-component of an Actor/other Component (still something left of the spec)
+        elif rest:
+            uobjects = [comp for uobj in uobjects for comp in uobj.get_actor_components()
+                        if re.match(next_, comp.get_name())]
+        # next_ is the name of the property
+        else:
+            resolved = ([uobj for uobj in uobjects if uobj.has_property(next_)], next_)
+            break
+
+    if len(cache.resolved_prop_specs) >= _MAX_RESOLVED_PROP_SPECS:
+        cache.resolved_prop_specs.clear()
+    cache.resolved_prop_specs[prop_spec] = resolved
+    return resolved
+
+
+def convert_property(prop):
+    """
+    Converts a property value into its observation (msgpack-able) value: FVector/FRotator -> 3-tuple, uobject -> str,
+    bool/int/float -> unchanged.
+
+    Raises: TypeError if the property type is not supported.
+    """
+    type_ = type(prop)
+    if type_ == ue.FVector or type_ == ue.FRotator:
+        return prop[0], prop[1], prop[2]
+    elif type_ == ue.UObject:
+        return str(prop)
+    elif type_ == bool or type_ == int or type_ == float:
+        return prop
+    raise TypeError("Property has an unsupported type ({})".format(type_))
+
+
+def get_warm_state():
+    """
+    Returns all caches of this module, such that they can be handed to set_warm_state after this module was
+    reloaded (see marlene_server.reload_server).
+    """
+    return {"world_caches": _WORLD_CACHES, "key_filters": _KEY_FILTERS, "observers": (_OBSERVERS, _OBSERVER_GENERATION),
+            "keys": _KEYS}
+
+
+def set_warm_state(state):
+    """
+    Takes over the caches of a previously loaded version of this module (see get_warm_state) as far as they are
+    still valid: Per world, the spec (incl. the packed arrays) only if its key still matches, the uobject handles
+    (incl. the resolved property specifiers) only if we are still in the same world generation.
+
+    Args:
+        state (dict): The warm state returned by get_warm_state.
+
+    Returns: The list of names of the caches that were taken over (per world: name:world id).
+    """
+    global _OBSERVERS, _OBSERVER_GENERATION
+    taken_over = []
+    # (the observer generation has to go on counting, the handles of the worlds refer to it)
+    if "observers" in state:
+        _OBSERVERS, _OBSERVER_GENERATION = state["observers"]
+    _KEYS.update(state.get("keys", {}))
+    previous = select_world(0)
+    try:
+        for world_id, old_cache in sorted(state.get("world_caches", {}).items()):
+            select_world(world_id)
+            cache = get_world_cache()
+            cache.world, cache.generation = old_cache.world, old_cache.generation
+            # bumps the generation if the world has changed (or is gone) in the meantime
+            playing_world = get_playing_world()
+            if not playing_world:
+                continue
+            cache = get_world_cache()
+            if old_cache.resolved_generation == cache.generation:
+                for name in ("controller", "controllers", "mappings", "actors", "actor_index", "observers",
+                             "observer_set", "observers_generation"):
+                    setattr(cache, name, getattr(old_cache, name, None))
+                cache.resolved_prop_specs.update(old_cache.resolved_prop_specs)
+                taken_over.append("handles:{}".format(world_id))
+            if old_cache.spec is not None and old_cache.spec_key == get_spec_key(playing_world):
+                cache.spec, cache.spec_key, cache.spec_hash = old_cache.spec, old_cache.spec_key, old_cache.spec_hash
+                cache.packed_floats, cache.packed_bools = old_cache.packed_floats, old_cache.packed_bools
+                taken_over.append("spec:{}".format(world_id))
+    finally:
+        select_world(previous)
+    _KEY_FILTERS.update(state["key_filters"])
+    taken_over.append("key_filters")
+    return taken_over
+
+
+def get_cache_sizes():
+    """
+    Returns: The sizes of all caches of this module: `key_filters` (number of cached KeyFilters), `keys` (number of
+        cached Key structs), `observer_generation`, `observers` (number of registered observers) and per world id:
+        `generation`, `spec` (whether a spec is cached), `packed_bytes` (size of the packed arrays), `actors` (number
+        of indexed actors), `resolved_prop_specs` (number of cached specifiers) and `observers` (number of resolved
+        observers of that world).
+    """
+    return {"key_filters": len(_KEY_FILTERS), "keys": len(_KEYS), "observer_generation": _OBSERVER_GENERATION,
+            "observers": len(_OBSERVERS),
+            "worlds": {world_id: {"generation": cache.generation, "spec": cache.spec is not None,
+                                  "packed_bytes": cache.packed_floats.nbytes + cache.packed_bools.nbytes,
+                                  "actors": sum(len(a) for a in cache.actor_index.values()) if cache.actor_index else 0,
+                                  "resolved_prop_specs": len(cache.resolved_prop_specs),
+                                  "observers": len(cache.observers) if cache.observers is not None else 0}
+                       for world_id, cache in _WORLD_CACHES.items()}}
+
+
 def get_child_component(component, component_class):
     for child in component.AttachChildren:
         if child.is_a(component_class):
@@ -51,6 +421,39 @@ def get_child_component(component, component_class):
     return None
 
 
+def apply_inputs(controller, axes=None, actions=None, delta_time=1.0/60.0):
+    """
+    Injects axis values and action (key) presses/releases into a player controller.
+
+    Args:
+        controller (uobject): The PlayerController to send the inputs to.
+        axes (Union[list,None]): List of (key name, axis value) tuples.
+        actions (Union[list,None]): List of (key name, pressed?) tuples.
+        delta_time (float): The delta time to pass along with the axis values.
+    """
+    if axes:
+        for axis in axes:
+            # ue.log("-> axis {}={} (key={})".format(key_name, axis[1], Key(KeyName=key_name)))
+            controller.input_axis(get_key(axis[0]), axis[1], delta_time)
+    if actions:
+        for action in actions:
+            # ue.log("-> action {}={}".format(action_name, action[1]))
+            controller.input_key(get_key(action[0]), EInputEvent.IE_Pressed if action[1] else EInputEvent.IE_Released)
+
+
+def release_actions(controller, actions):
+    """
+    Releases all keys of the given actions again (otherwise sending True in two succinct steps would not(!) repeat
+    the action).
+
+    Args:
+        controller (uobject): The PlayerController to send the releases to.
+        actions (list): List of (key name, pressed?) tuples.
+    """
+    for action in actions:
+        controller.input_key(get_key(action[0]), EInputEvent.IE_Released)
+
+
 async def pause_game():
     """
     Pauses the game.
@@ -122,6 +525,7 @@ def get_scene_capture_and_texture(owner, observer):
                 scene_capture = owner.add_actor_component(SceneCaptureComponent2D, "MaRLEnE_SceneCapture", camera)
                 scene_capture.bCaptureEveryFrame = False
                 scene_capture.bCaptureOnMovement = False
+                memory.track("scene_capture", scene_capture)
                 #ue.log("DEBUG: get_scene_capture_and_texture -> found a camera w/o scene_capture comp -> added it; texture={}".format(
                 #    texture))
         # error -> return nothing
@@ -133,6 +537,7 @@ def get_scene_capture_and_texture(owner, observer):
         # use MLObserver's width/height settings
         texture = scene_capture.TextureTarget =\
             ue.create_transient_texture_render_target2d(observer.Width or 84, observer.Height or 84)
+        memory.track("render_target", texture)
         #ue.log("DEBUG: scene capture is created in get_scene_image texture={} will return texture {}".format(scene_capture.TextureTarget, texture))
 
     return scene_capture, texture
@@ -180,42 +585,106 @@ def get_scene_capture_image(playing_world, scene_capture, texture, gray_scale=Fa
     return img
 
 
-def compile_obs_dict(reward=None):
+class KeyFilter(object):
+    """
+    Decides which observation keys (obs_name/prop_name or obs_name/camera) get evaluated by compile_obs_dict.
+    Patterns are regular expressions that have to match the beginning of a key, so a plain observer name selects
+    all keys of that observer.
+    """
+    def __init__(self, include=None, exclude=None):
+        """
+        Args:
+            include (Union[list,None]): Patterns of the keys to evaluate (None for all keys).
+            exclude (Union[list,None]): Patterns of the keys to skip (applied after `include`).
+        """
+        self.include = [re.compile(p) for p in include] if include is not None else None
+        self.exclude = [re.compile(p) for p in exclude] if exclude else []
+        self._decisions = {}  # cache: key -> whether to evaluate the key
+
+    def __call__(self, key):
+        if key not in self._decisions:
+            self._decisions[key] = (self.include is None or any(p.match(key) for p in self.include)) and \
+                not any(p.match(key) for p in self.exclude)
+        return self._decisions[key]
+
+
+def get_key_filter(include=None, exclude=None):
     """
-    Compiles the current observations (based on all active MLObservers) into a dictionary that is returned to the
-    UE4Env object's reset/step/... methods.
+    Returns the (cached) KeyFilter for the given include- and exclude-patterns.
 
     Args:
-        reward (Union[float,None]): The absolute global accumulated reward value to set (mostly used to reset
-            everything to 0 after a new episode is started).
+        include (Union[list,str,None]): Pattern(s) of the keys to evaluate (None for all keys).
+        exclude (Union[list,str,None]): Pattern(s) of the keys to skip.
+
+    Returns: The KeyFilter object or None if nothing would be filtered.
+    Raises: re.error if one of the patterns is malformatted.
+    """
+    if isinstance(include, str):
+        include = [include]
+    if isinstance(exclude, str):
+        exclude = [exclude]
+    if include is None and not exclude:
+        return None
 
-    Returns: The obs_dict as a python dict (ready to be sent back to the client).
+    cache_key = (tuple(include) if include is not None else None, tuple(exclude or ()))
+    if cache_key not in _KEY_FILTERS:
+        if len(_KEY_FILTERS) >= _MAX_KEY_FILTERS:
+            _KEY_FILTERS.clear()
+        _KEY_FILTERS[cache_key] = KeyFilter(include, exclude)
+    return _KEY_FILTERS[cache_key]
+
+
+def compile_obs_dict(key_filter=None, packed=False):
     """
-    global _REWARD
+    Compiles the current observations (based on all active MLObservers) into a frame dictionary that is then turned
+    into the reply for the UE4Env object's reset/step/... methods by the respective session (see Session.reply).
+
+    Args:
+        key_filter (Union[KeyFilter,None]): If given, only the keys accepted by this filter are evaluated (skipped
+            observers/properties cost nothing). Reward and is-terminal observers are always evaluated.
+        packed (bool): Whether to write all non-image observations (except strings) into the preallocated
+            float32/int8 arrays (see `packed_layout` in the spec) instead of the obs_dict.
 
+    Returns: The frame as a python dict with keys: `status`, `world_id` (the selected world), `obs_dict`, `reward`
+        (the absolute, accumulated reward value), `is_terminal`, `partial` (whether a key_filter was applied),
+        `key_filter`, `packed` (tuple of the float32 array, the int8 array and the packed layout or None), `spec_hash`
+        and `observer_owners`, `observer_rewards`, `observer_terminals` (per observer name; see group_by_agent).
+        Note: The arrays are re-used (overwritten) by the next call for the same world (each world has its own).
+    """
     playing_world = get_playing_world()
+    if packed:
+        # make sure the layout (and the arrays) are up to date
+        spec = get_spec(playing_world)
+        if spec["status"] != "ok":
+            return spec
+        layout = spec["packed_layout"]
+        float_slots, bool_slots = layout["floats"], layout["bools"]
+        cache = get_world_cache()
+        floats, bools = cache.packed_floats, cache.packed_bools
+    obs_dict = {}
     r = 0.0  # accumulated reward
     is_terminal = False
-    if reward is not None:
-        _REWARD = reward
+    # per observer: the owners, the rewards and the is-terminal flags (for grouping by agent; see group_by_agent)
+    owners, rewards, terminals = {}, {}, {}
+    trace = tracing.current
 
     # DEBUG
     #pydevd.settrace("localhost", port=20023, stdoutToServer=True, stderrToServer=True)  # DEBUG
     # END: DEBUG
 
-    for observer in MLObserver.GetRegisteredObservers():
-        owner, obs_name = sanity_check_observer(observer, playing_world)
-        if not owner:
-            continue
+    for observer, owner, obs_name in get_observers(playing_world):
+        if trace:
+            start = tracing.now_ns()
+        owners[obs_name] = owner
         # the reward observer
-        elif observer.ObserverType == 1:
+        if observer.ObserverType == 1:
             if len(observer.ObservedProperties) != 1:
                 return {"status": "error", "message": "Reward-observer {} has 0 or more than 1 property!".format(obs_name)}
             observed_prop = observer.ObservedProperties[0]
             prop_name = observed_prop.PropName
             if not owner.has_property(prop_name):
                 return {"status": "error", "message": "Reward-property {} is not a property of owner ({})!".format(prop_name, owner)}
-            r = owner.get_property(prop_name)
+            r = rewards[obs_name] = owner.get_property(prop_name)
         # the is_terminal observer
         elif observer.ObserverType == 2:
             if len(observer.ObservedProperties) != 1:
@@ -224,51 +693,264 @@ def compile_obs_dict(reward=None):
             prop_name = observed_prop.PropName
             if not owner.has_property(prop_name):
                 return {"status": "error", "message": "IsTerminal-property {} is not a property of owner ({})!".format(prop_name, owner)}
-            is_terminal = owner.get_property(prop_name)
+            is_terminal = terminals[obs_name] = owner.get_property(prop_name)
         # normal (non-reward/non-is_terminal) observer
         else:
             # this observer returns a camera image
-            if observer.bScreenCapture:
+            if observer.bScreenCapture and (key_filter is None or key_filter(obs_name + "/camera")):
                 try:
                     scene_capture, texture = get_scene_capture_and_texture(owner, observer)
                 except RuntimeError as e:
                     return {"status": "error", "message": "{}".format(e)}
                 img = get_scene_capture_image(playing_world, scene_capture, texture, observer.bGrayscale)
-                _OBS_DICT[obs_name + "/camera"] = img
+                obs_dict[obs_name + "/camera"] = img
+                if trace:
+                    trace.add("capture:" + obs_name, start)
 
             for observed_prop in observer.ObservedProperties:
                 if not observed_prop.bEnabled:
                     continue
                 prop_name = observed_prop.PropName
+                key = obs_name+"/"+prop_name
+                if key_filter is not None and not key_filter(key):
+                    continue
                 if not owner.has_property(prop_name):
                     continue
 
                 prop = owner.get_property(prop_name)
                 type_ = type(prop)
-                if type_ == ue.FVector or type_ == ue.FRotator:
-                    value = (prop[0], prop[1], prop[2])
-                elif type_ == ue.UObject:
-                    value = str(prop)
-                elif type_ == bool or type_ == int or type_ == float:
-                    value = prop
-                else:
+                if packed:
+                    if key in float_slots:
+                        offset = float_slots[key][0]
+                        if type_ == ue.FVector or type_ == ue.FRotator:
+                            floats[offset], floats[offset+1], floats[offset+2] = prop[0], prop[1], prop[2]
+                        else:
+                            floats[offset] = prop
+                        continue
+                    elif key in bool_slots:
+                        bools[bool_slots[key]] = prop
+                        continue
+
+                try:
+                    obs_dict[key] = convert_property(prop)
+                except TypeError:
                     return {"status": "error", "message": "Observed property {} has an unsupported type ({})".format(prop_name, type_)}
+        if trace:
+            trace.add("observer:" + obs_name, start)
+
+    return {"status": "ok", "world_id": _WORLD_ID, "obs_dict": obs_dict, "reward": r, "is_terminal": is_terminal,
+            "partial": key_filter is not None, "key_filter": key_filter, "packed": (floats, bools, layout) if packed else None,
+            "spec_hash": get_spec_hash(playing_world), "observer_owners": owners, "observer_rewards": rewards,
+            "observer_terminals": terminals}
+
+
+def get_agent_controllers(playing_world):
+    """
+    Returns: The list of all player controllers of the playing world (the list index is the agent index). Looked up
+        once per generation, so players joining in the middle of an episode are only found after the next reset.
+    """
+    cache = get_world_cache()
+    if cache.controllers is None:
+        controllers = []
+        for index in range(MAX_AGENTS):
+            controller = GameplayStatics.GetPlayerController(playing_world, index)
+            if controller is None:
+                break
+            controllers.append(controller)
+        cache.controllers = controllers
+    return cache.controllers
+
+
+def group_by_agent(frame, controllers):
+    """
+    Splits a compiled frame into per-agent observations, rewards and is-terminal flags.
+    An observer belongs to an agent if its owner (or the owner's owner, etc..) is the agent's controller or the pawn
+    it controls. Observers that belong to no agent are shared: their observations go to all agents, their reward is
+    added to all agents' rewards and their is-terminal flag ends all agents' episodes.
+    The packed observations of a packed frame are not split up (they stay in the frame's two arrays; the returned
+    observer -> agent mapping tells the client which of them belong to which agent).
+
+    Args:
+        frame (dict): The compiled frame (see compile_obs_dict).
+        controllers (list): The player controllers of the agents (see get_agent_controllers).
+
+    Returns: Tuple of: list of obs_dicts (one per agent), the absolute rewards (float array), the is-terminal flags
+        (bool array) and the agent index per observer name (None for shared observers).
+    """
+    agent_actors = [(controller, controller.K2_GetPawn()) for controller in controllers]
+    observer_agents = {}
+    for obs_name, owner in frame["observer_owners"].items():
+        actor, agent = owner, None
+        for _ in range(MAX_OWNER_DEPTH):
+            agent = next((i for i, actors in enumerate(agent_actors) if any(actor == a for a in actors)), None)
+            if agent is not None:
+                break
+            actor = actor.get_owner()
+            if actor is None:
+                break
+        observer_agents[obs_name] = agent
 
-                _OBS_DICT[obs_name+"/"+prop_name] = value
+    num_agents = len(controllers)
+    obs_dicts = [{} for _ in range(num_agents)]
+    for key, value in frame["obs_dict"].items():
+        agent = observer_agents.get(key.split("/", 1)[0])
+        if agent is None:
+            for obs_dict in obs_dicts:
+                obs_dict[key] = value
+        else:
+            obs_dicts[agent][key] = value
 
-    # update global total reward counter
-    prev_reward = _REWARD
-    _REWARD = r  # update global _REWARD counter
-    message = {"status": "ok", "obs_dict": _OBS_DICT, "_reward": (r - prev_reward), "_is_terminal": is_terminal}
-    return message
+    rewards = np.zeros((num_agents,), dtype=np.float32)
+    for obs_name, r in frame["observer_rewards"].items():
+        agent = observer_agents.get(obs_name)
+        if agent is None:
+            rewards += r
+        else:
+            rewards[agent] += r
+    terminals = np.zeros((num_agents,), dtype=np.bool_)
+    for obs_name, is_terminal in frame["observer_terminals"].items():
+        agent = observer_agents.get(obs_name)
+        if agent is None:
+            terminals |= bool(is_terminal)
+        else:
+            terminals[agent] |= bool(is_terminal)
+    return obs_dicts, rewards, terminals, observer_agents
 
 
-def get_spec():
+def get_packed_values(frame):
+    """
+    Generator over the observations of a packed frame (as they would have been stored in the obs_dict).
+
+    Args:
+        frame (dict): The packed frame (see compile_obs_dict).
+
+    Returns: Tuples of (key, value).
+    """
+    floats, bools, layout = frame["packed"]
+    for key, (offset, size) in layout["floats"].items():
+        yield key, tuple(floats[offset:offset+size].tolist()) if size > 1 else float(floats[offset])
+    for key, offset in layout["bools"].items():
+        yield key, bool(bools[offset])
+
+
+def get_spec_key(playing_world):
+    """
+    Returns a cheap key describing everything the spec depends on: The playing world, the set of observers of that
+    world (see get_observers; the observers of other worlds do not invalidate this world's spec) and the action- and
+    axis-mappings (names, keys and scales; looked up once per generation).
+    Mappings changed within a generation (e.g. a key rebound at runtime) are picked up by get_spec(refresh=True), other
+    changes that leave this key intact (e.g. observer properties) need an explicit `invalidate_spec()`.
+
+    Args:
+        playing_world (uworld): The UWorld object of the running Game.
+
+    Returns: A tuple that can be compared against the key of the cached spec.
+    """
+    get_observers(playing_world)
+    cache = get_world_cache()
+    if cache.mappings is None:
+        input_ = ue.get_mutable_default(InputSettings)
+        cache.mappings = tuple((action.ActionName, action.Key.KeyName) for action in input_.ActionMappings) + \
+            tuple((axis.AxisName, axis.Key.KeyName, axis.Scale) for axis in input_.AxisMappings)
+    return playing_world, cache.observer_set, cache.mappings
+
+
+def invalidate_spec():
+    """
+    Drops the cached spec (of the selected world) so that the next call to get_spec (or get_spec_hash) will re-build
+    it.
+    """
+    cache = get_world_cache()
+    cache.spec = cache.spec_key = cache.spec_hash = None
+
+
+def get_spec_hash(playing_world=None):
+    """
+    Returns the short hash of the current spec (re-building the spec only if it is not cached or out of date).
+    Clients compare this hash (sent with every obs_dict) against the one of their last `get_spec` call and only
+    re-fetch the spec on a mismatch.
+
+    Args:
+        playing_world (Union[uworld,None]): The UWorld object of the running Game (if already fetched by the caller).
+
+    Returns: The spec hash as a hex string (None if the spec could not be built).
+    """
+    get_spec(playing_world)
+    return get_world_cache().spec_hash
+
+
+def get_spec(playing_world=None, refresh=False):
     """
     Returns the observation_space (observers) and action_space (action- and axis-mappings) of the Game as a dict with
     keys: `observation_space` and `action_space`
+    The spec is only built once (per playing world) and then cached until the playing world, the registered
+    observers or the input settings change (see get_spec_key).
+
+    Args:
+        playing_world (Union[uworld,None]): The UWorld object of the running Game (if already fetched by the caller).
+        refresh (bool): Whether to ignore the cached spec and build a new one (also re-reads the input settings, see
+            get_spec_key).
+    """
+    if playing_world is None:
+        playing_world = get_playing_world()
+    cache = get_world_cache()
+    if refresh:
+        cache.mappings = None
+
+    key = get_spec_key(playing_world)
+    if not refresh and cache.spec is not None and key == cache.spec_key:
+        return cache.spec
+
+    spec = build_spec(playing_world)
+    # do not cache errors
+    if spec["status"] != "ok":
+        invalidate_spec()
+        return spec
+
+    spec["packed_layout"] = layout = build_packed_layout(spec["observation_space_desc"])
+    if len(cache.packed_floats) != layout["num_floats"]:
+        cache.packed_floats = np.zeros((layout["num_floats"],), dtype=np.float32)
+    if len(cache.packed_bools) != layout["num_bools"]:
+        cache.packed_bools = np.zeros((layout["num_bools"],), dtype=np.int8)
+
+    cache.spec_hash = hashlib.sha1(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+    spec["spec_hash"] = cache.spec_hash
+    cache.spec, cache.spec_key = spec, key
+    return spec
+
+
+def build_packed_layout(observation_space_desc):
+    """
+    Assigns a slot in the packed float32 array to each FVector/FRotator, float and int observation (ints are
+    stored as floats, so beware of values beyond 2^24) and a slot in the int8 array to each bool observation.
+    Camera images and strings are not packed.
+
+    Args:
+        observation_space_desc (dict): The observation space descriptor of the spec.
+
+    Returns: The layout dict with keys: `floats` (key -> (offset, size)), `bools` (key -> offset), `num_floats`
+        and `num_bools`.
+    """
+    floats, bools = {}, {}
+    num_floats = num_bools = 0
+    for key, desc in observation_space_desc.items():
+        if desc["type"] == "Bool":
+            bools[key] = num_bools
+            num_bools += 1
+        # cameras have a 2D/3D shape
+        elif desc["type"] in ("Continuous", "IntBox") and len(desc["shape"]) == 1:
+            floats[key] = (num_floats, desc["shape"][0])
+            num_floats += desc["shape"][0]
+    return {"floats": floats, "bools": bools, "num_floats": num_floats, "num_bools": num_bools}
+
+
+def build_spec(playing_world):
+    """
+    Builds the spec dict (see get_spec) from scratch.
+
+    Args:
+        playing_world (uworld): The UWorld object of the running Game.
     """
-    playing_world = get_playing_world()
 
     # build the action_space descriptor
     action_space_desc = {}
@@ -298,12 +980,11 @@ def get_spec():
 
     # build the observation_space descriptor
     observation_space_desc = {}
-    for observer in MLObserver.GetRegisteredObservers():
-        owner, obs_name = sanity_check_observer(observer, playing_world)
+    for observer, owner, obs_name in get_observers(playing_world):
         #ue.log("obs={} name={} owner={} enabled={} gray={} type={}".
         #       format(observer, obs_name, owner, observer.bEnabled, observer.bGrayscale, observer.ObserverType))
         # ignore reward observer (ObserverType=1) and is-terminal observer (ObserverType=2)
-        if not owner or observer.ObserverType > 0:
+        if observer.ObserverType > 0:
             continue
 
         # ue.log("DEBUG: get_spec observer {}".format(obs_name))
@@ -0,0 +1,303 @@
+"""
+ -------------------------------------------------------------------------
+ MaRLEnE - sessions.py
+
+ Per-connection state of the server (reward baseline, observation cache,
+ negotiated options) and the scheduler that serializes all commands that
+ touch the playing world.
+
+ created: 2026/10/19
+ -------------------------------------------------------------------------
+"""
+
+import unreal_engine as ue
+import asyncio
+import collections
+import numpy as np
+from output_queue import OutputQueue
+
+
+class Session(object):
+    """
+    The state of a single client connection.
+    Only one session at a time can be the controlling one (allowed to step/reset/set/seed the game), all others are
+    read-only and get their observations from the last compiled frame.
+    """
+
+    CONTROL = "control"
+    OBSERVE = "observe"
+
+    def __init__(self, id_, reader, writer, role):
+        self.id = id_
+        self.reader = reader
+        self.writer = writer
+        self.peername = writer.get_extra_info("peername")
+        # all messages to the client go through this (bounded) queue
+        self.output = OutputQueue(writer)
+        self.role = role
+        # per playing world (world id): the absolute reward value this session has seen last (used to calculate
+        # reward deltas), the same per agent (see reply_agents) and the obs_dict sent to this client (updated in
+        # place with every frame)
+        self.rewards = {}
+        self.agent_rewards = {}
+        self.obs_dicts = {}
+        # per playing world: the spec hash of the cached obs_dict (its keys are dropped once the spec changes) and
+        # the packed layout whose keys are not in the cached obs_dict (see _update_obs_cache)
+        self.spec_hashes = {}
+        self.packed_layouts = {}
+        # options negotiated via the `session` command
+        self.options = {}
+        # the push subscription of this session (see subscriptions.py)
+        self.subscription = None
+        # the number of messages received (for sampling traces) and the time it took to encode the last traced reply
+        self.num_messages = 0
+        self.last_encode_ns = None
+
+    @property
+    def is_controller(self):
+        return self.role == Session.CONTROL
+
+    def new_episode(self, world_id=None):
+        """
+        Resets the reward baselines and drops all cached observations (e.g. after the level was restarted).
+
+        Args:
+            world_id (Union[int,None]): The world that started a new episode (None for all worlds).
+        """
+        if world_id is None:
+            self.rewards.clear()
+            self.agent_rewards.clear()
+            self.obs_dicts.clear()
+            self.packed_layouts.clear()
+        else:
+            self.rewards.pop(world_id, None)
+            self.agent_rewards.pop(world_id, None)
+            self.obs_dicts.pop(world_id, None)
+            self.packed_layouts.pop(world_id, None)
+
+    def unsubscribe(self):
+        """
+        Cancels this session's subscription (if any).
+
+        Returns: The push stats of the cancelled subscription (None if there was no subscription).
+        """
+        if self.subscription is None:
+            return None
+        self.subscription.cancel()
+        stats = self.subscription.get_stats()
+        self.subscription = None
+        return stats
+
+    def reply(self, frame):
+        """
+        Turns a compiled frame (see server_utils.compile_obs_dict) into the reply message for this session.
+
+        Args:
+            frame (dict): The compiled frame.
+
+        Returns: The reply dict (ready to be sent back to the client).
+        """
+        if frame["status"] != "ok":
+            return frame
+        world_id = frame["world_id"]
+        cached = self._update_obs_cache(frame)
+        # partial frames are sent as they are (our cache would mix in stale values for the skipped keys)
+        obs_dict = frame["obs_dict"] if frame["partial"] else cached
+        prev_reward = self.rewards.get(world_id, 0.0)
+        self.rewards[world_id] = frame["reward"]
+        reply = {"status": "ok", "env_id": world_id, "obs_dict": obs_dict, "_reward": (frame["reward"] - prev_reward),
+                 "_is_terminal": frame["is_terminal"], "_partial": frame["partial"], "spec_hash": frame["spec_hash"]}
+        # packed mode: all non-image observations come in two arrays (see `packed_layout` in the spec)
+        if frame["packed"] is not None:
+            reply["obs_floats"], reply["obs_bools"] = frame["packed"][0], frame["packed"][1]
+        return reply
+
+    def reply_agents(self, frame, agents):
+        """
+        Turns a compiled frame into the multi-agent reply for this session: One obs_dict per agent (`obs_dicts`) and
+        the reward deltas and is-terminal flags as arrays (`_rewards`, `_is_terminals`; one entry per agent).
+        Packed frames keep their two arrays for all agents (`obs_floats`, `obs_bools`; see `packed_layout` in the spec)
+        plus the agent index per observer name (`observer_agents`; None for shared observers). Observations are sent
+        as they are (no copies), so out-of-band framing can send images shared by several agents only once.
+
+        Args:
+            frame (dict): The compiled frame.
+            agents (tuple): The frame grouped by agent (see server_utils.group_by_agent).
+
+        Returns: The reply dict (ready to be sent back to the client).
+        """
+        if frame["status"] != "ok":
+            return frame
+        obs_dicts, rewards, terminals, observer_agents = agents
+        world_id = frame["world_id"]
+        self._update_obs_cache(frame)
+        self.rewards[world_id] = frame["reward"]
+        # the number of agents changed -> new baseline
+        prev_rewards = self.agent_rewards.get(world_id)
+        if prev_rewards is None or len(prev_rewards) != len(rewards):
+            prev_rewards = np.zeros_like(rewards)
+        self.agent_rewards[world_id] = rewards
+        reply = {"status": "ok", "env_id": world_id, "obs_dicts": obs_dicts, "_rewards": rewards - prev_rewards,
+                 "_is_terminals": terminals, "_partial": frame["partial"], "spec_hash": frame["spec_hash"]}
+        if frame["packed"] is not None:
+            reply["obs_floats"], reply["obs_bools"] = frame["packed"][0], frame["packed"][1]
+            reply["observer_agents"] = observer_agents
+        return reply
+
+
+    def get_cache_sizes(self):
+        return {"obs_keys": sum(len(obs_dict) for obs_dict in self.obs_dicts.values()),
+                "bytes_queued": self.output.bytes_queued, "max_bytes_queued": self.output.max_bytes_queued}
+
+    def _get_obs_cache(self, frame):
+        # the cached obs_dict of the frame's world (a new one if the spec changed, e.g. an observer went away, so
+        # that keys that are gone don't pile up)
+        world_id = frame["world_id"]
+        cached = self.obs_dicts.get(world_id)
+        if cached is None or self.spec_hashes.get(world_id) != frame["spec_hash"]:
+            cached = self.obs_dicts[world_id] = {}
+            self.spec_hashes[world_id] = frame["spec_hash"]
+            self.packed_layouts.pop(world_id, None)
+        return cached
+
+    def _update_obs_cache(self, frame):
+        # merges the frame's obs_dict into the cached one; packed frames carry their packed keys in the arrays only,
+        # so the (stale) values of these keys from earlier, unpacked frames are dropped from the cache
+        cached = self._get_obs_cache(frame)
+        world_id = frame["world_id"]
+        if frame["packed"] is not None:
+            layout = frame["packed"][2]
+            if self.packed_layouts.get(world_id) is not layout:
+                for key in layout["floats"]:
+                    cached.pop(key, None)
+                for key in layout["bools"]:
+                    cached.pop(key, None)
+                self.packed_layouts[world_id] = layout
+        elif self.packed_layouts:
+            self.packed_layouts.pop(world_id, None)
+        cached.update(frame["obs_dict"])
+        return cached
+
+
+class SessionManager(object):
+    """
+    Keeps track of all open sessions, the controlling session and the last compiled frame.
+    """
+    def __init__(self):
+        self.sessions = {}
+        self.controller = None
+        self.last_frames = {}  # world ID -> the last frame compiled in that world
+        self.num_frames = 0
+        self._next_id = 0
+
+    def open(self, reader, writer):
+        """
+        Creates a new session for an incoming connection.
+        The first session gets control of the game, all further ones are read-only.
+        """
+        self._next_id += 1
+        role = Session.CONTROL if self.controller is None else Session.OBSERVE
+        session = Session(self._next_id, reader, writer, role)
+        if role == Session.CONTROL:
+            self.controller = session
+        self.sessions[session.id] = session
+        return session
+
+    def close(self, session):
+        session.unsubscribe()
+        session.output.close()
+        self.sessions.pop(session.id, None)
+        if self.controller is session:
+            self.controller = None
+
+    def set_role(self, session, role):
+        """
+        Changes the role of a session.
+
+        Returns: An error message if the role could not be granted, None otherwise.
+        """
+        if role == Session.CONTROL:
+            if self.controller is not None and self.controller is not session:
+                return "Session {} is already controlling the game!".format(self.controller.id)
+            self.controller = session
+        elif role == Session.OBSERVE:
+            if self.controller is session:
+                self.controller = None
+        else:
+            return "Unknown session role ({})!".format(role)
+        session.role = role
+        return None
+
+    def new_episode(self, world_id=None):
+        for session in self.sessions.values():
+            session.new_episode(world_id)
+
+    def publish(self, frame):
+        """
+        Stores a freshly compiled frame (per world) so that read-only sessions can be served without touching the
+        engine and hands it to all subscriptions for pushing.
+        """
+        if frame["status"] != "ok":
+            return
+        self.num_frames += 1
+        frame["frame"] = self.num_frames
+        self.last_frames[frame["world_id"]] = frame
+        for session in self.sessions.values():
+            if session.subscription is not None:
+                session.subscription.offer(frame)
+
+
+class CommandScheduler(object):
+    """
+    Serializes all commands that need the playing world: Commands are executed one after the other (in the order
+    they came in), such that e.g. a `step` can never run while a `reset` is still waiting for the restarted level.
+    A command that comes in while no other command is running is executed right away (w/o any extra hop through the
+    event loop, each of which would cost an engine tick). Commands coming in while another one is running are
+    queued and then executed back to back by a single task.
+    """
+    def __init__(self, execute):
+        """
+        Args:
+            execute (callable): Coroutine function taking (session, message) and returning the response dict.
+        """
+        self.execute = execute
+        self.queue = collections.deque()  # items: (session, message, future)
+        self.busy = False
+        self.task = None
+
+    async def submit(self, session, message):
+        """
+        Executes a command as soon as no other command is running and returns its response.
+        """
+        if self.busy:
+            future = asyncio.get_event_loop().create_future()
+            self.queue.append((session, message, future))
+            return await future
+        self.busy = True
+        try:
+            return await self._execute(session, message)
+        finally:
+            if self.queue:
+                self.task = asyncio.ensure_future(self._run_queued())
+            else:
+                self.busy = False
+
+    async def _run_queued(self):
+        try:
+            while self.queue:
+                session, message, future = self.queue.popleft()
+                # the client went away while waiting
+                if future.cancelled():
+                    continue
+                response = await self._execute(session, message)
+                if not future.cancelled():
+                    future.set_result(response)
+        finally:
+            self.busy = False
+
+    async def _execute(self, session, message):
+        try:
+            return await self.execute(session, message)
+        except Exception as e:
+            ue.log_error("Command {} failed: {}".format(message.get("cmd"), e))
+            return {"status": "error", "message": "{}".format(e)}
@@ -0,0 +1,103 @@
+"""
+ -------------------------------------------------------------------------
+ MaRLEnE - subscriptions.py
+
+ Push-based observation subscriptions: A session subscribes to some
+ observers (by name pattern) and from then on gets every compiled frame
+ pushed to it (up to a maximum rate) without having to step the game.
+
+ created: 2026/10/19
+ -------------------------------------------------------------------------
+"""
+
+import asyncio
+import re
+import server_utils as util
+
+
+class Subscription(object):
+    """
+    Pushes compiled frames (restricted to the observers matching some name patterns) to a session at a maximum rate.
+    A frame that comes in while the previous one of the same world is still waiting to be sent replaces it
+    (coalescing; frames of different worlds, e.g. from a batched step, are all sent). Frames that would have to be
+    sent to a client that does not keep up with reading are dropped.
+    """
+    def __init__(self, session, send, patterns=None, max_rate=None):
+        """
+        Args:
+            session (Session): The subscribing session.
+            send (callable): Function taking (message, session, droppable) to send a message to the client (returns
+                False if the message was dropped).
+            patterns (Union[list,None]): Regexp patterns for the names of the observers to push (None for all).
+            max_rate (Union[float,None]): The max. number of frames per second to push per world (None for no limit).
+        """
+        self.session = session
+        self.send = send
+        self.patterns = [re.compile(p) for p in patterns] if patterns is not None else None
+        self.max_rate = max_rate
+        self.min_interval = 1.0 / max_rate if max_rate else 0.0
+        self.pending = {}  # world ID -> the latest frame of that world not pushed yet
+        self.num_pushed = 0
+        self.num_coalesced = 0
+        self.num_dropped = 0
+        self._matches = {}  # cache: obs key -> whether the key's observer matches our patterns
+        self._event = asyncio.Event()
+        self.task = asyncio.ensure_future(self._run())
+
+    def matches(self, key):
+        if self.patterns is None:
+            return True
+        if key not in self._matches:
+            obs_name = key.split("/", 1)[0]
+            self._matches[key] = any(p.match(obs_name) for p in self.patterns)
+        return self._matches[key]
+
+    def offer(self, frame):
+        """
+        Hands a freshly compiled frame to this subscription (does not send anything itself).
+        """
+        if frame["world_id"] in self.pending:
+            self.num_coalesced += 1
+        self.pending[frame["world_id"]] = frame
+        self._event.set()
+
+    def cancel(self):
+        self.task.cancel()
+
+    def get_stats(self):
+        return {"num_pushed": self.num_pushed, "num_coalesced": self.num_coalesced, "num_dropped": self.num_dropped}
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        last_push = None
+        while True:
+            await self._event.wait()
+            # respect the max. rate (frames coming in in the meantime will be coalesced)
+            if last_push is not None:
+                wait = last_push + self.min_interval - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            self._event.clear()
+            pending, self.pending = self.pending, {}
+
+            if self.session.output.closed:
+                break
+            # in the order the frames were compiled
+            for frame in sorted(pending.values(), key=lambda f: f["frame"]):
+                self._push(frame)
+            last_push = loop.time()
+
+    def _push(self, frame):
+        # slow reader -> drop this frame (before even packing it)
+        if self.session.output.is_congested():
+            self.num_dropped += 1
+            return
+        obs_dict = {k: v for k, v in frame["obs_dict"].items() if self.matches(k)}
+        if frame["packed"] is not None:
+            obs_dict.update((k, v) for k, v in util.get_packed_values(frame) if self.matches(k))
+        if self.send({"status": "ok", "push": "obs", "frame": frame["frame"], "env_id": frame["world_id"],
+                      "obs_dict": obs_dict,
+                      "reward": frame["reward"], "is_terminal": frame["is_terminal"]}, self.session, True):
+            self.num_pushed += 1
+        else:
+            self.num_dropped += 1
@@ -0,0 +1,101 @@
+"""
+ -------------------------------------------------------------------------
+ MaRLEnE - tracing.py
+
+ Per-phase latency tracing of single requests (receive, decode, dispatch,
+ input injection, each tick, each observer, encode): Traced requests get
+ their timing breakdown attached to the reply (`_trace`) and are kept in
+ a ring buffer that can be exported as Chrome trace-event JSON (to be
+ loaded in chrome://tracing or Perfetto).
+ A request is traced if it has the field `trace`=True or if its session
+ samples 1-in-N requests (session option `trace_sample`=N).
+
+ created: 2026/10/19
+ -------------------------------------------------------------------------
+"""
+
+import collections
+import json
+import os
+import time
+
+# monotonic nanoseconds (perf_counter_ns is only available from python 3.7 on)
+if hasattr(time, "perf_counter_ns"):
+    now_ns = time.perf_counter_ns
+else:
+    def now_ns():
+        return int(time.perf_counter() * 1e9)
+
+# the trace of the command that is currently being executed (commands run one at a time, see CommandScheduler)
+current = None
+# the most recent traces (for exporting)
+traces = collections.deque(maxlen=1000)
+
+
+class Trace(object):
+    """
+    The timings (spans) of one traced request.
+    """
+    def __init__(self, cmd, session_id, start_ns):
+        self.cmd = cmd
+        self.session_id = session_id
+        self.start = start_ns
+        self.spans = []  # (name, start ns, end ns)
+
+    def add(self, name, start_ns, end_ns=None):
+        """
+        Records a span that started at `start_ns` and ends at `end_ns` (default: now).
+        """
+        self.spans.append((name, start_ns, now_ns() if end_ns is None else end_ns))
+
+    def to_dict(self):
+        """
+        Returns: The compact (msgpack-able) trace: `cmd`, `t0` (ns) and `spans` (list of [name, start offset from t0,
+            duration]; all in ns).
+        """
+        return {"cmd": self.cmd, "t0": self.start,
+                "spans": [[name, start - self.start, end - start] for name, start, end in self.spans]}
+
+    def to_events(self):
+        """
+        Returns: The spans as Chrome trace events ("complete" events in microseconds; one thread per session).
+        """
+        return [{"name": name, "cat": self.cmd, "ph": "X", "ts": start / 1000.0, "dur": (end - start) / 1000.0,
+                 "pid": os.getpid(), "tid": self.session_id} for name, start, end in self.spans]
+
+
+def start(message, session, start_ns):
+    """
+    Decides whether to trace an incoming message and if so, starts its trace.
+
+    Args:
+        message (dict): The incoming message.
+        session (Session): The session the message came in from.
+        start_ns (int): The time the message started to come in.
+
+    Returns: The new Trace (None if the message is not traced).
+    """
+    session.num_messages += 1
+    sample = session.options.get("trace_sample")
+    if message.get("trace") or (sample and session.num_messages % sample == 0):
+        return Trace(message.get("cmd"), session.id, start_ns)
+    return None
+
+
+def record(trace):
+    traces.append(trace)
+
+
+def get_events():
+    return [event for trace in traces for event in trace.to_events()]
+
+
+def export(path):
+    """
+    Writes all recorded traces as a Chrome trace-event JSON file.
+
+    Returns: The number of exported traces.
+    """
+    with open(path, "w") as f:
+        json.dump({"traceEvents": get_events(), "displayTimeUnit": "ns"}, f)
+    return len(traces)
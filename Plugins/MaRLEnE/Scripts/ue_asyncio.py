@@ -6,8 +6,13 @@ loop = asyncio.new_event_loop()
 
 asyncio.set_event_loop(loop)
 
+# the number of engine ticks so far (e.g. to cache engine lookups for the duration of one tick)
+ticks = 0
+
 
 def ticker_loop(delta_time):
+    global ticks
+    ticks += 1
     try:
         loop.stop()
         loop.run_forever()
@@ -0,0 +1,47 @@
+"""
+ -------------------------------------------------------------------------
+ MaRLEnE - soak/engine.py
+
+ Runs marlene_server.py on top of the stand-in `unreal_engine` module
+ (see soak/unreal_engine) in a plain python process, e.g. as the target
+ of the soak harness (soak/soak.py).
+
+ usage: python soak/engine.py --port 6025 --worlds 2 --agents 1
+
+ created: 2026/10/19
+ -------------------------------------------------------------------------
+"""
+
+import argparse
+import os
+import sys
+
+SOAK_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(os.path.dirname(SOAK_DIR), "Plugins", "MaRLEnE", "Scripts")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs marlene_server.py on a stand-in engine.")
+    parser.add_argument("--port", type=int, default=6025, help="The port to listen on.")
+    parser.add_argument("--fps", type=float, default=60.0, help="The number of engine ticks per second.")
+    parser.add_argument("--seconds", type=float, default=None, help="Stop after this many seconds (default: never).")
+    parser.add_argument("--worlds", type=int, default=1, help="The number of playing worlds.")
+    parser.add_argument("--agents", type=int, default=1, help="The number of player controllers per world.")
+    parser.add_argument("--capture-size", type=int, default=84, help="Width/height of the camera observations.")
+    args = parser.parse_args()
+
+    # the stand-in engine has to shadow any real unreal_engine module
+    sys.path[:0] = [SOAK_DIR, SCRIPTS_DIR]
+    import unreal_engine as ue
+    from unreal_engine.classes import MaRLEnESettings
+    ue.config.update(num_worlds=args.worlds, num_agents=args.agents, capture_size=args.capture_size)
+    ue.get_mutable_default(MaRLEnESettings).Port = args.port
+    os.environ.pop("MARLENE_PORT_ADD", None)
+
+    import ue_asyncio
+    import marlene_server
+    ue.engine_main(args.fps, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
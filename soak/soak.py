@@ -0,0 +1,551 @@
+"""
+ -------------------------------------------------------------------------
+ MaRLEnE - soak/soak.py
+
+ Soak and fault-injection harness for the server protocol: Drives many
+ concurrent clients against a marlene_server (by default one spawned on
+ the stand-in engine, see soak/engine.py) with randomized command mixes,
+ pipelined requests, slow readers (subscribed to pushes, reading late)
+ and injected faults (truncated headers and bodies, malformatted headers,
+ undecodable bodies, abrupt disconnects and connection resets).
+ Every `--report-interval` seconds it reports the throughput, the latency
+ percentiles, the server's memory (via the `memory` command), protocol
+ errors (see Stats) and the errors the server logged (incl. the stand-in
+ engine's violations, e.g. a level being ticked while it restarts).
+ Exits with code 1 if any protocol error or server error was seen.
+
+ usage: python soak/soak.py --clients 32 --duration 3600 --worlds 2
+
+ created: 2026/10/19
+ -------------------------------------------------------------------------
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import math
+import os
+import random
+import sys
+import time
+
+SOAK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(SOAK_DIR), "Plugins", "MaRLEnE", "Scripts"))
+import framing
+import msgpack
+import msgpack_numpy as mnp
+
+# make msgpack use the numpy-specific de/encoders
+mnp.patch()
+
+
+# the faults that can be injected (see Client.inject_fault)
+FAULTS = ("truncated_header", "truncated_body", "bad_header", "garbage_body", "prefix_body", "disconnect", "abort")
+# the command mixes (command -> weight) of the controlling and the read-only clients
+CONTROL_MIX = {"step": 50, "batched_step": 8, "reset": 4, "set": 4, "get": 8, "get_spec": 4, "get_obs": 6, "seed": 2,
+               "get_stats": 2, "memory": 1, "release": 1}
+OBSERVE_MIX = {"get_obs": 35, "get": 25, "get_spec": 15, "get_stats": 5, "memory": 2, "grab": 10}
+# the replies to these commands have to carry observations
+OBS_COMMANDS = ("step", "reset", "set")
+
+
+class LatencyHistogram(object):
+    """
+    Log-bucketed latencies (constant memory, percentiles accurate to about 2%).
+    """
+    RATIO = 1.02
+
+    def __init__(self):
+        self.buckets = collections.Counter()
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.buckets[int(math.log(max(seconds * 1e6, 1.0)) / math.log(self.RATIO))] += 1
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        self.buckets.update(other.buckets)
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        """
+        Returns: The `p`-th percentile in seconds (the upper bound of its bucket; 0.0 if there are no latencies).
+        """
+        target, total = p / 100.0 * self.count, 0
+        for bucket in sorted(self.buckets):
+            total += self.buckets[bucket]
+            if total >= target:
+                return min(self.RATIO ** (bucket + 1) / 1e6, self.max)
+        return 0.0
+
+    def to_dict(self):
+        return {"count": self.count, "p50": self.percentile(50), "p90": self.percentile(90),
+                "p99": self.percentile(99), "p99.9": self.percentile(99.9), "max": self.max}
+
+
+class Stats(object):
+    """
+    The counters of one report interval (and, merged, of the whole run).
+    Protocol errors are: replies that are no dicts or have no valid `status`, observation replies without
+    observations, timeouts, the server closing a connection unexpectedly and injected faults that are not answered
+    as expected (an error reply for malformatted headers and undecodable bodies).
+    """
+    def __init__(self):
+        self.latencies = LatencyHistogram()
+        self.num_requests = 0
+        self.num_connections = 0
+        self.num_pushes = 0
+        self.faults = collections.Counter()
+        self.error_replies = collections.Counter()
+        self.protocol_errors = collections.Counter()
+
+    def merge(self, other):
+        self.latencies.merge(other.latencies)
+        self.num_requests += other.num_requests
+        self.num_connections += other.num_connections
+        self.num_pushes += other.num_pushes
+        self.faults.update(other.faults)
+        self.error_replies.update(other.error_replies)
+        self.protocol_errors.update(other.protocol_errors)
+
+    def to_dict(self):
+        return {"latency": self.latencies.to_dict(), "num_requests": self.num_requests,
+                "num_connections": self.num_connections, "num_pushes": self.num_pushes, "faults": dict(self.faults),
+                "error_replies": dict(self.error_replies), "protocol_errors": dict(self.protocol_errors)}
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class Client(object):
+    """
+    One simulated client: Connects, negotiates a session, sends a random number of randomized commands (injecting
+    faults now and then), disconnects and starts over until the harness stops it.
+    """
+    def __init__(self, harness, index, slow):
+        self.harness = harness
+        self.args = harness.args
+        self.index = index
+        self.slow = slow
+        self.rng = random.Random(self.args.seed * 1000 + index)
+        self.reader = self.writer = None
+        self.out_of_band = False
+        self.is_controller = False
+        # whether the server may close the connection on us (backpressure policy `disconnect`)
+        self.may_be_dropped = False
+
+    @property
+    def stats(self):
+        return self.harness.stats
+
+    async def run(self):
+        while True:
+            try:
+                await self.connection()
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                if not self.may_be_dropped:
+                    self.stats.protocol_errors["connection lost: {}".format(type(e).__name__)] += 1
+            except asyncio.TimeoutError:
+                self.stats.protocol_errors["timeout"] += 1
+            except ProtocolError as e:
+                self.stats.protocol_errors["{}".format(e)] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats.protocol_errors["client failed: {}".format(type(e).__name__)] += 1
+            finally:
+                self.close()
+            await asyncio.sleep(self.rng.uniform(0.0, 0.05))
+
+    async def connection(self):
+        self.reader, self.writer = await asyncio.open_connection(self.args.host, self.args.port)
+        self.stats.num_connections += 1
+        self.may_be_dropped = False
+        options = {"packed": self.rng.random() < 0.3, "out_of_band": self.rng.random() < 0.3}
+        if self.slow:
+            options["backpressure"] = self.rng.choice(("block", "drop", "disconnect"))
+            options["high_watermark"] = self.rng.choice((64 * 1024, 1024 * 1024))
+            options["low_watermark"] = options["high_watermark"] // 4
+            self.may_be_dropped = options["backpressure"] == "disconnect"
+        self.out_of_band = False
+        reply = await self.request({"cmd": "session", "options": options})
+        self.out_of_band = options["out_of_band"]
+        self.is_controller = reply.get("role") == "control"
+        if self.slow:
+            await self.request({"cmd": "subscribe"})
+
+        for _ in range(self.rng.randint(10, 200)):
+            if self.rng.random() < self.args.fault_rate:
+                if not await self.inject_fault(self.rng.choice(FAULTS)):
+                    return
+            elif self.rng.random() < 0.05:
+                await self.pipeline(self.rng.randint(2, 8))
+            else:
+                await self.timed_request(self.random_command())
+            if self.slow:
+                # let the pushes pile up
+                await asyncio.sleep(self.rng.uniform(0.0, 0.5))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    def random_command(self):
+        mix = CONTROL_MIX if self.is_controller else OBSERVE_MIX
+        cmd = self.rng.choices(list(mix), weights=list(mix.values()))[0]
+        message = {"cmd": cmd}
+        if cmd in ("step", "batched_step"):
+            message = {"cmd": "step", "num_ticks": self.rng.randint(1, 4), "packed": self.rng.random() < 0.5,
+                       "axes": [["D", self.rng.uniform(-1.0, 1.0)]], "actions": [["SpaceBar", self.rng.random() < 0.5]]}
+            if cmd == "batched_step" and self.args.worlds > 1:
+                message["worlds"] = "all"
+        elif cmd == "reset" and self.args.worlds > 1 and self.rng.random() < 0.5:
+            message["worlds"] = "all"
+        elif cmd == "set":
+            message["setters"] = [["Player:Score", 0.0, False]]
+        elif cmd == "get":
+            message["getters"] = ["Player:Location", "Player:Score"]
+        elif cmd == "seed":
+            message["value"] = self.rng.randint(0, 1000)
+        elif cmd in ("release", "grab"):
+            message = {"cmd": "session", "role": "observe" if cmd == "release" else "control"}
+        if self.args.worlds > 1 and "worlds" not in message and self.rng.random() < 0.5:
+            message["world"] = self.rng.randrange(self.args.worlds)
+        return message
+
+    async def timed_request(self, message):
+        start = time.perf_counter()
+        await self.request(message)
+        if not self.slow:
+            self.stats.latencies.add(time.perf_counter() - start)
+
+    async def request(self, message):
+        self.writer.write(framing.pack(message))
+        return await self.read_reply(message)
+
+    async def pipeline(self, num_requests):
+        """
+        Sends several requests in one write, then reads all replies (which have to come back in order).
+        """
+        messages = [self.random_command() for _ in range(num_requests)]
+        self.writer.write(b"".join(framing.pack(message) for message in messages))
+        for message in messages:
+            await self.read_reply(message)
+
+    async def read_reply(self, message):
+        while True:
+            reply = await asyncio.wait_for(read_message(self.reader, self.out_of_band), self.args.timeout)
+            if isinstance(reply, dict) and "push" in reply:
+                self.stats.num_pushes += 1
+                continue
+            break
+        self.check_reply(message, reply)
+        return reply
+
+    def check_reply(self, message, reply):
+        self.stats.num_requests += 1
+        if not isinstance(reply, dict) or reply.get("status") not in ("ok", "error"):
+            raise ProtocolError("malformatted reply to '{}'".format(message.get("cmd")))
+        if reply["status"] == "error":
+            self.stats.error_replies[_error_kind(reply.get("message"))] += 1
+            return
+        cmd = message["cmd"]
+        if cmd == "session":
+            self.is_controller = reply.get("role") == "control"
+        elif cmd in OBS_COMMANDS and "worlds" not in message and "obs_dict" not in reply:
+            raise ProtocolError("'{}' reply without observations".format(cmd))
+        elif "worlds" in message and "env_ids" not in reply:
+            raise ProtocolError("batched '{}' reply without env ids".format(cmd))
+
+    async def inject_fault(self, fault):
+        """
+        Injects a fault into the connection.
+
+        Returns: Whether the connection is still usable.
+        """
+        self.stats.faults[fault] += 1
+        if fault == "truncated_header":
+            self.writer.write(b"0000")
+        elif fault == "truncated_body":
+            data = framing.pack(self.random_command())
+            self.writer.write(data[:framing.HEADER_LEN + (len(data) - framing.HEADER_LEN) // 2])
+        elif fault == "disconnect":
+            # the server has to cope with writing the reply to a closed connection
+            self.writer.write(framing.pack(self.random_command()))
+        elif fault == "abort":
+            self.writer.write(framing.pack(self.random_command()))
+            self.writer.transport.abort()
+            self.writer = None
+        elif fault == "bad_header":
+            self.writer.write(self.rng.choice((b"abcdefgh", b"-0000001", b"00000x12")))
+            await self.expect_error(fault)
+            # the server has to close the connection (it cannot find the start of the next message; pushes that were
+            # queued before the error may still arrive)
+            while True:
+                try:
+                    reply = await asyncio.wait_for(read_message(self.reader, self.out_of_band), self.args.timeout)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if not (isinstance(reply, dict) and "push" in reply):
+                    raise ProtocolError("server kept the connection after a bad header")
+        elif fault == "garbage_body":
+            self.writer.write(b"00000004\xc1\xc1\xc1\xc1")
+            await self.expect_error(fault)
+            return True
+        elif fault == "prefix_body":
+            # a complete frame whose body is only the start of a message: must not swallow the next frame (the next
+            # regular request checks that)
+            body = msgpack.packb(self.random_command())
+            body = body[:len(body) // 2]
+            self.writer.write(bytes("{:08d}".format(len(body)), encoding="ascii") + body)
+            await self.expect_error(fault)
+            return True
+        if self.writer is not None:
+            await self.writer.drain()
+        return False
+
+    async def expect_error(self, fault):
+        while True:
+            reply = await asyncio.wait_for(read_message(self.reader, self.out_of_band), self.args.timeout)
+            if not (isinstance(reply, dict) and "push" in reply):
+                break
+        if not isinstance(reply, dict) or reply.get("status") != "error":
+            raise ProtocolError("no error reply after fault '{}'".format(fault))
+
+
+async def read_message(reader, out_of_band=False):
+    """
+    Reads one message sent by the server: Out-of-band framed (see framing.py) or plain msgpack (whose numpy arrays
+    can only be decoded as raw bytes; all other bytes are turned back into strings).
+    """
+    if out_of_band:
+        return await framing.read_message(reader)
+    header = await reader.readexactly(framing.HEADER_LEN)
+    try:
+        length = int(header)
+    except ValueError:
+        raise ProtocolError("malformatted header from server")
+    try:
+        return _decode(msgpack.unpackb(await reader.readexactly(length), raw=True))
+    except (ValueError, TypeError) as e:
+        raise ProtocolError("undecodable message from server ({})".format(type(e).__name__))
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        return {_decode(k): _decode(v) for k, v in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [_decode(v) for v in value]
+    elif isinstance(value, bytes):
+        try:
+            return value.decode("utf-8")
+        except UnicodeDecodeError:
+            return value
+    return value
+
+
+def _error_kind(message):
+    # error messages without their variable parts (ids, values, ...)
+    return " ".join(word for word in "{}".format(message).split() if not any(c.isdigit() for c in word))[:80]
+
+
+class Harness(object):
+    def __init__(self, args):
+        self.args = args
+        self.stats = Stats()
+        self.total = Stats()
+        self.process = None
+        self.server_log = collections.Counter()
+        self.server_errors = collections.OrderedDict()  # the first lines of each kind of logged error
+        self.memory = []  # (seconds since start, rss, number of gc objects)
+        self.reports = []
+        self.start = None
+
+    async def run(self):
+        if self.args.spawn:
+            await self.spawn_server()
+        await self.wait_for_server()
+        monitor = await asyncio.open_connection(self.args.host, self.args.port)
+        # (the monitor must not keep the control of the game)
+        await self.monitor_request(monitor, {"cmd": "session", "role": "observe"})
+
+        self.start = time.time()
+        num_slow = int(round(self.args.clients * self.args.slow_readers))
+        clients = [asyncio.ensure_future(Client(self, i, i >= self.args.clients - num_slow).run())
+                   for i in range(self.args.clients)]
+        try:
+            await self.sample_memory(monitor)
+            while time.time() - self.start < self.args.duration:
+                await asyncio.sleep(min(self.args.report_interval, self.args.duration - (time.time() - self.start)))
+                await self.sample_memory(monitor)
+                self.report()
+        finally:
+            # (a cancellation gets lost if it races with a reply in asyncio.wait_for: cancel until all clients stopped)
+            pending = clients
+            while pending:
+                for client in pending:
+                    client.cancel()
+                _, pending = await asyncio.wait(pending, timeout=1.0)
+            monitor[1].close()
+            if self.process is not None:
+                self.process.terminate()
+                try:
+                    await asyncio.wait_for(self.process.wait(), 10.0)
+                except asyncio.TimeoutError:
+                    self.process.kill()
+                    await self.process.wait()
+        return self.summary()
+
+    async def spawn_server(self):
+        command = [sys.executable, os.path.join(SOAK_DIR, "engine.py"), "--port", str(self.args.port),
+                   "--worlds", str(self.args.worlds), "--agents", str(self.args.agents), "--fps", str(self.args.fps)]
+        self.process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE,
+                                                            stderr=asyncio.subprocess.STDOUT)
+        asyncio.ensure_future(self.read_server_output())
+
+    async def read_server_output(self):
+        log_file = open(self.args.server_log, "w") if self.args.server_log else None
+        try:
+            while True:
+                line = await self.process.stdout.readline()
+                if not line:
+                    break
+                line = line.decode("utf-8", "replace").rstrip()
+                if log_file is not None:
+                    log_file.write(line + "\n")
+                if line.startswith("[warning] dt="):
+                    continue
+                for kind, marker in (("errors", "[error]"), ("engine_violations", "Engine violation"),
+                                     ("tracebacks", "Traceback"), ("warnings", "[warning]")):
+                    if marker in line:
+                        self.server_log[kind] += 1
+                        if kind != "warnings":
+                            self.server_errors.setdefault(_error_kind(line), line)
+        finally:
+            if log_file is not None:
+                log_file.close()
+
+    async def wait_for_server(self):
+        deadline = time.time() + 30.0
+        while True:
+            try:
+                _, writer = await asyncio.open_connection(self.args.host, self.args.port)
+                writer.close()
+                return
+            except OSError:
+                if time.time() > deadline or (self.process is not None and self.process.returncode is not None):
+                    raise RuntimeError("Server on {}:{} did not come up!".format(self.args.host, self.args.port))
+                await asyncio.sleep(0.2)
+
+    async def monitor_request(self, monitor, message):
+        reader, writer = monitor
+        writer.write(framing.pack(message))
+        while True:
+            reply = await asyncio.wait_for(read_message(reader), self.args.timeout)
+            if "push" not in reply:
+                return reply
+
+    async def sample_memory(self, monitor):
+        try:
+            reply = await self.monitor_request(monitor, {"cmd": "memory"})
+        except (asyncio.TimeoutError, ConnectionError, asyncio.IncompleteReadError):
+            self.stats.protocol_errors["memory monitor failed"] += 1
+            return
+        self.memory.append((time.time() - self.start, reply.get("rss"), reply["gc"]["num_objects"]))
+
+    def report(self):
+        elapsed = time.time() - self.start
+        interval = self.args.report_interval
+        stats, self.stats = self.stats, Stats()
+        self.total.merge(stats)
+        latency = stats.latencies.to_dict()
+        _, rss, num_objects = self.memory[-1] if self.memory else (0, None, None)
+        report = dict(stats.to_dict(), elapsed=elapsed, throughput=stats.num_requests / interval, rss=rss,
+                      num_objects=num_objects, server_log=dict(self.server_log))
+        self.reports.append(report)
+        print("[{:6.0f}s] {:8.1f} req/s  p50 {:6.2f}ms  p99 {:6.2f}ms  p99.9 {:6.2f}ms  max {:7.2f}ms | conns {} "
+              "pushes {} faults {} | protocol errors {} | server rss {} objects {} | logged errors {} violations {}".
+              format(elapsed, report["throughput"], latency["p50"] * 1e3, latency["p99"] * 1e3,
+                     latency["p99.9"] * 1e3, latency["max"] * 1e3, stats.num_connections, stats.num_pushes,
+                     sum(stats.faults.values()), sum(stats.protocol_errors.values()), _format_bytes(rss),
+                     num_objects, self.server_log["errors"], self.server_log["engine_violations"]))
+        sys.stdout.flush()
+
+    def summary(self):
+        self.total.merge(self.stats)
+        elapsed = time.time() - self.start
+        summary = dict(self.total.to_dict(), elapsed=elapsed, throughput=self.total.num_requests / elapsed,
+                       memory=self.get_memory_growth(), server_log=dict(self.server_log),
+                       server_errors=list(self.server_errors.values())[:20], reports=self.reports)
+        print("\nSummary: {} requests in {:.0f}s ({:.1f} req/s), latency p50 {:.2f}ms p99 {:.2f}ms p99.9 {:.2f}ms "
+              "max {:.2f}ms".format(self.total.num_requests, elapsed, summary["throughput"],
+                                    *(summary["latency"][p] * 1e3 for p in ("p50", "p99", "p99.9", "max"))))
+        print("Memory: {}".format(summary["memory"]))
+        print("Faults injected: {}".format(dict(self.total.faults)))
+        print("Error replies: {}".format(dict(self.total.error_replies)))
+        print("Protocol errors: {}".format(dict(self.total.protocol_errors) or "none"))
+        print("Server log: {}".format(dict(self.server_log) or "clean"))
+        for line in summary["server_errors"]:
+            print("  " + line)
+        return summary
+
+    def get_memory_growth(self):
+        """
+        Returns: The server's RSS at the start and the end, its growth and the growth rate per hour (least-squares
+            slope over all samples; None for all if the RSS could not be sampled).
+        """
+        samples = [(t, rss) for t, rss, _ in self.memory if rss is not None]
+        if len(samples) < 2:
+            return None
+        mean_t = sum(t for t, _ in samples) / len(samples)
+        mean_rss = sum(rss for _, rss in samples) / len(samples)
+        variance = sum((t - mean_t) ** 2 for t, _ in samples)
+        slope = sum((t - mean_t) * (rss - mean_rss) for t, rss in samples) / variance if variance else 0.0
+        return {"rss_start": samples[0][1], "rss_end": samples[-1][1], "growth": samples[-1][1] - samples[0][1],
+                "growth_per_hour": slope * 3600.0, "num_objects_start": self.memory[0][2],
+                "num_objects_end": self.memory[-1][2]}
+
+
+def _format_bytes(num_bytes):
+    return "{:.1f}MB".format(num_bytes / 1048576.0) if num_bytes is not None else "n/a"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak and fault-injection harness for the MaRLEnE server.")
+    parser.add_argument("--host", default="localhost", help="The server's host.")
+    parser.add_argument("--port", type=int, default=6025, help="The server's port.")
+    parser.add_argument("--no-spawn", dest="spawn", action="store_false",
+                        help="Don't spawn a server on the stand-in engine (drive an already running one).")
+    parser.add_argument("--worlds", type=int, default=1, help="The number of playing worlds (of the spawned server).")
+    parser.add_argument("--agents", type=int, default=1, help="The number of player controllers per world.")
+    parser.add_argument("--fps", type=float, default=120.0, help="The engine ticks per second of the spawned server.")
+    parser.add_argument("--clients", type=int, default=16, help="The number of concurrent clients.")
+    parser.add_argument("--duration", type=float, default=60.0, help="The duration of the run in seconds.")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="Seconds between two reports.")
+    parser.add_argument("--slow-readers", type=float, default=0.125,
+                        help="The fraction of clients that subscribe to pushes and read them late.")
+    parser.add_argument("--fault-rate", type=float, default=0.02, help="The probability of a fault per request.")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for a reply.")
+    parser.add_argument("--seed", type=int, default=0, help="The random seed.")
+    parser.add_argument("--server-log", default=None, help="File to write the spawned server's output to.")
+    parser.add_argument("--json", default=None, help="File to write the summary (incl. all reports) to.")
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    summary = loop.run_until_complete(Harness(args).run())
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    failed = summary["protocol_errors"] or any(summary["server_log"].get(kind) for kind in
+                                                ("errors", "engine_violations", "tracebacks"))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
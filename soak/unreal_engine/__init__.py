@@ -0,0 +1,180 @@
+"""
+ -------------------------------------------------------------------------
+ MaRLEnE - soak/unreal_engine
+
+ Stand-in for the UnrealEnginePython `unreal_engine` module: just enough
+ of the API used by the server scripts to run marlene_server.py outside
+ of UE4 (see soak/engine.py). Each playing world holds a tiny game (one
+ pawn per player controller moving along x and scoring on `Fire`).
+ Like in UE4, `restart_level` only takes effect at the next engine tick.
+ Engine calls that touch a world whose level is still restarting are
+ logged as errors ("Engine violation: ..."), which the soak harness
+ reports.
+
+ created: 2026/10/19
+ -------------------------------------------------------------------------
+"""
+
+import random
+import sys
+import time
+
+_tickers = []
+_mutable_defaults = {}
+_worlds = []
+# settings of the stand-in (see soak/engine.py)
+config = {"num_worlds": 1, "num_agents": 1, "capture_size": 84}
+
+
+def log(message):
+    print("[log] {}".format(message))
+    sys.stdout.flush()
+
+
+def log_warning(message):
+    print("[warning] {}".format(message))
+    sys.stdout.flush()
+
+
+def log_error(message):
+    print("[error] {}".format(message))
+    sys.stdout.flush()
+
+
+def add_ticker(ticker, interval=0):
+    _tickers.append(ticker)
+    return ticker
+
+
+def remove_ticker(ticker):
+    if ticker in _tickers:
+        _tickers.remove(ticker)
+
+
+def get_mutable_default(cls):
+    if cls not in _mutable_defaults:
+        _mutable_defaults[cls] = cls()
+    return _mutable_defaults[cls]
+
+
+def set_random_seed(value):
+    random.seed(value)
+
+
+def load_class(path):
+    pass
+
+
+class FVector(tuple):
+    def __new__(cls, x=0.0, y=0.0, z=0.0):
+        return tuple.__new__(cls, (x, y, z))
+
+    def __add__(self, other):
+        return type(self)(*(a + b for a, b in zip(self, other)))
+
+
+class FRotator(FVector):
+    pass
+
+
+class UObject(object):
+    def __init__(self, name, world=None, owner=None, **props):
+        self._name = name
+        self._world = world
+        self._owner = owner
+        self._props = props
+        self._components = []
+        self._valid = True
+
+    def __str__(self):
+        return self._name
+
+    def get_name(self):
+        return self._name
+
+    def is_valid(self):
+        return self._valid
+
+    def has_world(self):
+        return self._world is not None
+
+    def get_world(self):
+        return self._world
+
+    def get_owner(self):
+        return self._owner
+
+    def is_a(self, cls):
+        return isinstance(self, cls)
+
+    def has_property(self, name):
+        return name in self._props or hasattr(type(self), name)
+
+    def get_property(self, name):
+        self._check()
+        return self._props[name] if name in self._props else getattr(self, name)
+
+    def set_property(self, name, value):
+        self._check()
+        self._props[name] = value
+
+    def get_actor_components(self):
+        return list(self._components)
+
+    def get_actor_components_by_type(self, cls):
+        return [component for component in self._components if isinstance(component, cls)]
+
+    def add_actor_component(self, cls, name, parent=None):
+        component = cls(name, self._world, self)
+        self._components.append(component)
+        if parent is not None:
+            parent.AttachChildren.append(component)
+        return component
+
+    def _check(self):
+        if not self._valid:
+            log_error("Engine violation: {} was accessed after it was destroyed!".format(self._name))
+        elif self._world is not None and self._world is not self and self._world.restart_pending:
+            log_error("Engine violation: {} was accessed while its level was restarting!".format(self._name))
+
+
+class _TextureRenderTarget2D(UObject):
+    def __init__(self, width, height):
+        UObject.__init__(self, "TextureRenderTarget2D")
+        self.SizeX, self.SizeY = width, height
+
+    def render_target_get_data(self):
+        return bytearray(self.SizeX * self.SizeY * 4)
+
+
+def create_transient_texture_render_target2d(width, height):
+    return _TextureRenderTarget2D(width, height)
+
+
+def all_worlds():
+    if not _worlds:
+        from .classes import World
+        _worlds.extend(World("World_{}".format(i)) for i in range(config["num_worlds"]))
+    return list(_worlds)
+
+
+def engine_main(fps=60.0, seconds=None):
+    """
+    The engine loop: Restarts pending levels, then calls all tickers (among them the ue_asyncio loop) and ticks
+    all unpaused worlds (`fps` times per second; for `seconds` seconds or forever).
+    """
+    start = last = time.time()
+    while seconds is None or last - start < seconds:
+        now = time.time()
+        delta_time = now - last
+        last = now
+        for world in all_worlds():
+            world.finish_restart()
+        for ticker in list(_tickers):
+            if ticker(delta_time) is False:
+                remove_ticker(ticker)
+        # (a world whose level is restarting is not ticked by the engine, but may be ticked by a script)
+        for world in all_worlds():
+            if not world.paused and not world.restart_pending:
+                world.world_tick(delta_time, True)
+        time.sleep(max(0.0, 1.0 / fps - (time.time() - now)))
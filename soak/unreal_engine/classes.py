@@ -0,0 +1,181 @@
+from . import UObject, FVector, FRotator, config, log_error
+
+
+class _Struct(object):
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class MaRLEnESettings(object):
+    def __init__(self):
+        self.Port = 6025
+        self.Address = "localhost"
+
+
+class GeneralProjectSettings(object):
+    ProjectName = "SoakGame"
+
+
+class InputSettings(object):
+    def __init__(self):
+        from .structs import Key
+        self.ActionMappings = [_Struct(ActionName="Fire", Key=Key(KeyName="SpaceBar")),
+                               _Struct(ActionName="Fire", Key=Key(KeyName="Gamepad_FaceButton_Bottom"))]
+        self.AxisMappings = [_Struct(AxisName="MoveRight", Key=Key(KeyName="D"), Scale=1.0),
+                             _Struct(AxisName="MoveRight", Key=Key(KeyName="A"), Scale=-1.0)]
+
+
+class ActorComponent(UObject):
+    def __init__(self, name, world=None, owner=None, **props):
+        UObject.__init__(self, name, world, owner, **props)
+        self.AttachChildren = []
+
+
+class CameraComponent(ActorComponent):
+    pass
+
+
+class SceneCaptureComponent2D(ActorComponent):
+    TextureTarget = None
+
+    def CaptureScene(self):
+        self._check()
+
+
+class MLObserver(ActorComponent):
+    _registered = []
+
+    def __init__(self, name, world, owner, props=(), observer_type=0, screen_capture=False, gray=False):
+        ActorComponent.__init__(self, name, world, owner)
+        self.ObservedProperties = [_Struct(PropName=prop, bEnabled=True) for prop in props]
+        self.ObserverType = observer_type
+        self.bScreenCapture = screen_capture
+        self.bGrayscale = gray
+        self.Width = self.Height = config["capture_size"]
+        MLObserver._registered.append(self)
+
+    @staticmethod
+    def GetRegisteredObservers():
+        return [observer for observer in MLObserver._registered if observer._valid]
+
+
+class Actor(UObject):
+    pass
+
+
+class PlayerController(UObject):
+    def __init__(self, world, index):
+        UObject.__init__(self, "PlayerController_{}".format(index), world)
+        self.pawn = None
+        self.axes = {}
+        self.pressed = set()
+
+    def K2_GetPawn(self):
+        return self.pawn
+
+    def input_axis(self, key, value, delta_time):
+        self.axes[key.KeyName] = value
+
+    def input_key(self, key, event):
+        from .enums import EInputEvent
+        if event == EInputEvent.IE_Pressed:
+            self.pressed.add(key.KeyName)
+        else:
+            self.pressed.discard(key.KeyName)
+
+
+class _GameViewportClient(object):
+    def game_viewport_client_set_rendering_flag(self, flag):
+        pass
+
+
+class World(UObject):
+    """
+    A playing (Game) world with one pawn per player controller: Each pawn moves along x (axis `MoveRight`) and
+    scores a point per tick in which `Fire` is pressed; the episode ends after 1000 points.
+    """
+    def __init__(self, name):
+        UObject.__init__(self, name)
+        self._world = self
+        self.paused = False
+        self.restart_pending = False
+        self.controllers = [PlayerController(self, i) for i in range(config["num_agents"])]
+        self.viewport = _GameViewportClient()
+        self.actors = []
+        self._start_level()
+
+    def get_world_type(self):
+        return 1
+
+    def get_game_viewport(self):
+        return self.viewport
+
+    def get_player_controller(self, index=0):
+        return self.controllers[index]
+
+    def all_actors(self):
+        return list(self.actors)
+
+    def restart_level(self):
+        # (takes effect at the next engine tick, see finish_restart)
+        self.restart_pending = True
+
+    def finish_restart(self):
+        if not self.restart_pending:
+            return
+        for observer in MLObserver._registered:
+            if observer._world is self:
+                observer._valid = False
+        MLObserver._registered[:] = [observer for observer in MLObserver._registered if observer._valid]
+        for actor in self.actors:
+            actor._valid = False
+            for component in actor._components:
+                component._valid = False
+        self.restart_pending = False
+        self._start_level()
+
+    def world_tick(self, delta_time, increase_fundamental_tick=True):
+        if self.restart_pending:
+            log_error("Engine violation: {} was ticked while its level was restarting!".format(self._name))
+            return
+        for controller in self.controllers:
+            pawn = controller.pawn
+            move = controller.axes.get("D", 0.0) - controller.axes.get("A", 0.0)
+            pawn.set_property("Location", pawn.get_property("Location") + FVector(move, 0.0, 0.0))
+            if "SpaceBar" in controller.pressed:
+                score = pawn.get_property("Score") + 1.0
+                pawn.set_property("Score", score)
+                pawn.set_property("GameOver", score >= 1000.0)
+
+    def _start_level(self):
+        self.actors = []
+        camera = Actor("Camera_1", self)
+        camera.add_actor_component(CameraComponent, "Camera", None)
+        camera._components.append(MLObserver("CamObs", self, camera, screen_capture=True, gray=True))
+        self.actors.append(camera)
+        for i, controller in enumerate(self.controllers):
+            pawn = Actor("Player_{}".format(i), self, controller, Location=FVector(0.0, 0.0, 0.0),
+                         Rotation=FRotator(0.0, 0.0, 0.0), Score=0.0, GameOver=False, Lives=3,
+                         Target=UObject("Enemy"))
+            controller.pawn = pawn
+            prefix = "P{}".format(i) if i > 0 else "Player"
+            pawn._components.append(MLObserver(prefix + "Obs", self, pawn,
+                                               props=("Location", "Rotation", "Lives", "Target", "GameOver")))
+            pawn._components.append(MLObserver(prefix + "Score", self, pawn, props=("Score",), observer_type=1))
+            pawn._components.append(MLObserver(prefix + "Term", self, pawn, props=("GameOver",), observer_type=2))
+            self.actors.append(pawn)
+
+
+class GameplayStatics(object):
+    @staticmethod
+    def SetGamePaused(world, paused):
+        world.paused = paused
+        return True
+
+    @staticmethod
+    def IsGamePaused(world):
+        return world.paused
+
+    @staticmethod
+    def GetPlayerController(world, index):
+        return world.controllers[index] if index < len(world.controllers) else None
@@ -0,0 +1,3 @@
+class EInputEvent(object):
+    IE_Pressed = 0
+    IE_Released = 1
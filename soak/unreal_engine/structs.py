@@ -0,0 +1,3 @@
+class Key(object):
+    def __init__(self, KeyName=""):
+        self.KeyName = KeyName